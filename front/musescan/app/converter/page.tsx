@@ -1,6 +1,6 @@
 "use client"
 
-import { useState } from "react"
+import { useEffect, useRef, useState } from "react"
 import Image from "next/image"
 import Link from "next/link"
 import { ArrowLeft, Download, FileImage, Loader2, MusicIcon } from "lucide-react"
@@ -12,6 +12,7 @@ import { Separator } from "@/components/ui/separator"
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/tabs"
 import { FileUploader } from "@/components/file-uploader"
 import { convertSheetToMidi } from "@/lib/sheet-to-midi"
+import { prebinarizeImage } from "@/lib/prebinarize"
 
 export default function ConverterPage() {
   const [file, setFile] = useState<File | null>(null)
@@ -19,18 +20,29 @@ export default function ConverterPage() {
   const [isProcessing, setIsProcessing] = useState(false)
   const [progress, setProgress] = useState(0)
   const [activeTab, setActiveTab] = useState("upload")
+  // 업로드 전 브라우저에서 축소 + 이진화 (업로드 용량/서버 디코딩 감소)
+  const [prebinarize, setPrebinarize] = useState(true)
+  const objectUrlRef = useRef<string | null>(null)
 
   const [midiDownloadUrl, setMidiDownloadUrl] = useState<string | null>(null)
   const [mp3PlaybackUrl, setMp3PlaybackUrl] = useState<string | null>(null)
 
+  const revokePreviewUrl = () => {
+    if (objectUrlRef.current) {
+      URL.revokeObjectURL(objectUrlRef.current)
+      objectUrlRef.current = null
+    }
+  }
+
+  useEffect(() => revokePreviewUrl, [])
+
   const handleFileChange = (file: File | null) => {
     if (!file) return
     setFile(file)
-    const reader = new FileReader()
-    reader.onload = (e) => {
-      setPreview(e.target?.result as string)
-    }
-    reader.readAsDataURL(file)
+    // base64 data URL 대신 object URL (파일을 다시 읽거나 복사하지 않음)
+    revokePreviewUrl()
+    objectUrlRef.current = URL.createObjectURL(file)
+    setPreview(objectUrlRef.current)
     setActiveTab("preview")
   }
 
@@ -51,7 +63,8 @@ export default function ConverterPage() {
     }, 200)
 
     try {
-      const result = await convertSheetToMidi(file)
+      const upload = prebinarize ? await prebinarizeImage(file) : file
+      const result = await convertSheetToMidi(upload)
 
       if (result.success) {
         setMp3PlaybackUrl(result.mp3DownloadUrl ?? null)
@@ -59,7 +72,10 @@ export default function ConverterPage() {
         console.log("[📊] Preview image URL:", preview)
         console.log("[🎶] MP3 playback URL:", mp3PlaybackUrl)
         console.log("[📥] MIDI download URL:", midiDownloadUrl)
-        if (result.previewImageUrl) setPreview(result.previewImageUrl)
+        if (result.previewImageUrl) {
+          revokePreviewUrl()
+          setPreview(result.previewImageUrl)
+        }
         setProgress(100)
         setActiveTab("result")
       } else {
@@ -139,13 +155,25 @@ export default function ConverterPage() {
                             alt="Sheet music preview"
                             width={800}
                             height={600}
+                            unoptimized
                             className="mx-auto max-h-[400px] w-auto object-contain"
                           />
                         </div>
                         <div className="flex items-center justify-between">
-                          <div className="flex items-center gap-2">
-                            <FileImage className="h-4 w-4 text-muted-foreground" />
-                            <span className="text-sm text-muted-foreground">{file?.name}</span>
+                          <div className="flex items-center gap-4">
+                            <div className="flex items-center gap-2">
+                              <FileImage className="h-4 w-4 text-muted-foreground" />
+                              <span className="text-sm text-muted-foreground">{file?.name}</span>
+                            </div>
+                            <label className="flex items-center gap-1 text-xs text-muted-foreground">
+                              <input
+                                type="checkbox"
+                                checked={prebinarize}
+                                onChange={(e) => setPrebinarize(e.target.checked)}
+                                disabled={isProcessing}
+                              />
+                              Optimize before upload
+                            </label>
                           </div>
                           <Button onClick={handleConvert} disabled={isProcessing}>
                             {isProcessing ? (
@@ -25,7 +25,7 @@ export function FileUploader({ onFileChange }: FileUploaderProps) {
   const { getRootProps, getInputProps, open } = useDropzone({
     onDrop,
     accept: {
-      "image/*": [".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp"],
+      "image/*": [".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".tif", ".tiff"],
       "application/pdf": [".pdf"],
     },
     maxFiles: 1,
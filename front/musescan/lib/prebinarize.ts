@@ -0,0 +1,37 @@
+import type { PrebinarizeResponse } from "./prebinarize.worker"
+
+// 서버가 처리하는 해상도에 맞춘 최대 폭 (A4 300dpi ≈ 2480px). 이보다 큰 사진/스캔은 축소 후 업로드
+export const TARGET_MAX_WIDTH = 2480
+
+// 브라우저가 직접 디코딩할 수 없는 형식(PDF/TIFF)은 원본 그대로 업로드
+function canPrebinarize(file: File) {
+  return /^image\/(png|jpeg|webp|bmp|gif)$/.test(file.type)
+}
+
+// 악보 이미지를 Web Worker에서 축소 + 이진화해 1-bit PNG File로 반환
+export async function prebinarizeImage(file: File, maxWidth = TARGET_MAX_WIDTH): Promise<File> {
+  if (!canPrebinarize(file) || typeof Worker === "undefined" || typeof OffscreenCanvas === "undefined") {
+    return file
+  }
+
+  const worker = new Worker(new URL("./prebinarize.worker.ts", import.meta.url), { type: "module" })
+  try {
+    const bitmap = await createImageBitmap(file)
+    const result = await new Promise<PrebinarizeResponse>((resolve, reject) => {
+      worker.onmessage = (event: MessageEvent<PrebinarizeResponse>) => resolve(event.data)
+      worker.onerror = (event) => reject(new Error(event.message))
+      worker.postMessage({ bitmap, maxWidth }, [bitmap])
+    })
+    if (!result.png) throw new Error(result.error ?? "Prebinarization failed")
+
+    const name = `${file.name.replace(/\.[^.]+$/, "")}.png`
+    console.log(`[🗜️] ${file.name} ${(file.size / 1024).toFixed(0)}KB → ${name} ` +
+      `${(result.png.byteLength / 1024).toFixed(0)}KB (${result.width}x${result.height}, 1-bit)`)
+    return new File([result.png], name, { type: "image/png" })
+  } catch (error) {
+    console.warn("Prebinarization failed, uploading original file:", error)
+    return file
+  } finally {
+    worker.terminate()
+  }
+}
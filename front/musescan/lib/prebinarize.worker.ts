@@ -0,0 +1,141 @@
+// 업로드 전 전처리 (메인 스레드를 막지 않도록 Web Worker에서 실행)
+// 1) 목표 해상도로 축소  2) Otsu 전역 임계값으로 이진화  3) 1-bit 흑백 PNG로 인코딩
+// 서버는 1-bit PNG를 이진화 완료 입력으로 보고 흑백 그대로 디코딩한다
+
+export interface PrebinarizeRequest {
+  bitmap: ImageBitmap
+  maxWidth: number
+}
+
+export interface PrebinarizeResponse {
+  png?: ArrayBuffer
+  width?: number
+  height?: number
+  error?: string
+}
+
+const CRC_TABLE = (() => {
+  const table = new Uint32Array(256)
+  for (let n = 0; n < 256; n++) {
+    let c = n
+    for (let k = 0; k < 8; k++) c = c & 1 ? 0xedb88320 ^ (c >>> 1) : c >>> 1
+    table[n] = c >>> 0
+  }
+  return table
+})()
+
+function crc32(bytes: Uint8Array, crc = 0xffffffff) {
+  for (let i = 0; i < bytes.length; i++) crc = CRC_TABLE[(crc ^ bytes[i]) & 0xff] ^ (crc >>> 8)
+  return crc
+}
+
+function chunk(type: string, data: Uint8Array) {
+  const out = new Uint8Array(12 + data.length)
+  const view = new DataView(out.buffer)
+  view.setUint32(0, data.length)
+  for (let i = 0; i < 4; i++) out[4 + i] = type.charCodeAt(i)
+  out.set(data, 8)
+  view.setUint32(8 + data.length, (crc32(out.subarray(4, 8 + data.length)) ^ 0xffffffff) >>> 0)
+  return out
+}
+
+async function deflate(data: Uint8Array) {
+  // PNG IDAT은 zlib 형식 = CompressionStream("deflate")
+  const stream = new Blob([data]).stream().pipeThrough(new CompressionStream("deflate"))
+  return new Uint8Array(await new Response(stream).arrayBuffer())
+}
+
+function otsuThreshold(histogram: Uint32Array, total: number) {
+  let sum = 0
+  for (let i = 0; i < 256; i++) sum += i * histogram[i]
+  let sumBackground = 0
+  let weightBackground = 0
+  let best = 127
+  let bestVariance = -1
+  for (let t = 0; t < 256; t++) {
+    weightBackground += histogram[t]
+    if (weightBackground === 0) continue
+    const weightForeground = total - weightBackground
+    if (weightForeground === 0) break
+    sumBackground += t * histogram[t]
+    const meanBackground = sumBackground / weightBackground
+    const meanForeground = (sum - sumBackground) / weightForeground
+    const variance = weightBackground * weightForeground * (meanBackground - meanForeground) ** 2
+    if (variance > bestVariance) {
+      bestVariance = variance
+      best = t
+    }
+  }
+  return best
+}
+
+async function prebinarize({ bitmap, maxWidth }: PrebinarizeRequest) {
+  const scale = Math.min(1, maxWidth / bitmap.width)
+  const width = Math.max(1, Math.round(bitmap.width * scale))
+  const height = Math.max(1, Math.round(bitmap.height * scale))
+
+  const canvas = new OffscreenCanvas(width, height)
+  const ctx = canvas.getContext("2d", { willReadFrequently: true })!
+  ctx.imageSmoothingQuality = "high"
+  ctx.fillStyle = "#fff"
+  ctx.fillRect(0, 0, width, height)
+  ctx.drawImage(bitmap, 0, 0, width, height)
+  bitmap.close()
+  const rgba = ctx.getImageData(0, 0, width, height).data
+
+  // 흑백 변환 (OpenCV BGR2GRAY와 같은 가중치) + 히스토그램
+  const gray = new Uint8Array(width * height)
+  const histogram = new Uint32Array(256)
+  for (let i = 0, p = 0; i < gray.length; i++, p += 4) {
+    const v = (rgba[p] * 299 + rgba[p + 1] * 587 + rgba[p + 2] * 114 + 500) / 1000
+    gray[i] = v
+    histogram[gray[i]]++
+  }
+  const threshold = otsuThreshold(histogram, gray.length)
+
+  // 1-bit 행 패킹: 행마다 filter 바이트(0) + ceil(width / 8) 바이트, MSB부터, 1 = 흰색
+  const rowBytes = Math.ceil(width / 8)
+  const raw = new Uint8Array((rowBytes + 1) * height)
+  for (let y = 0; y < height; y++) {
+    const rowStart = y * (rowBytes + 1) + 1
+    for (let x = 0; x < width; x++) {
+      if (gray[y * width + x] > threshold) raw[rowStart + (x >> 3)] |= 0x80 >> (x & 7)
+    }
+  }
+
+  const header = new Uint8Array(13)
+  const view = new DataView(header.buffer)
+  view.setUint32(0, width)
+  view.setUint32(4, height)
+  header[8] = 1 // bit depth
+  header[9] = 0 // color type: grayscale
+
+  const parts = [
+    new Uint8Array([0x89, 0x50, 0x4e, 0x47, 0x0d, 0x0a, 0x1a, 0x0a]),
+    chunk("IHDR", header),
+    chunk("IDAT", await deflate(raw)),
+    chunk("IEND", new Uint8Array(0)),
+  ]
+  const png = new Uint8Array(parts.reduce((n, part) => n + part.length, 0))
+  let offset = 0
+  for (const part of parts) {
+    png.set(part, offset)
+    offset += part.length
+  }
+  return { png: png.buffer, width, height }
+}
+
+// tsconfig는 dom lib 기준이라 worker 전역 스코프로 좁혀서 사용
+const scope = self as unknown as {
+  onmessage: ((event: MessageEvent<PrebinarizeRequest>) => void) | null
+  postMessage: (message: PrebinarizeResponse, transfer?: Transferable[]) => void
+}
+
+scope.onmessage = async (event) => {
+  try {
+    const result = await prebinarize(event.data)
+    scope.postMessage(result, [result.png])
+  } catch (error) {
+    scope.postMessage({ error: String(error) })
+  }
+}
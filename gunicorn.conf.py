@@ -0,0 +1,40 @@
+import os
+import gc
+
+# ------------------------
+# 운영 서버 설정 (gunicorn -c gunicorn.conf.py main:app / python musescan.py serve)
+# ------------------------
+# - preload_app: 부모 프로세스가 main.py 를 import 하며 모델을 한 번만 로드
+#   → fork 된 워커들은 가중치 메모리를 copy-on-write 로 공유 (워커마다 다시 로드하지 않음)
+#   ultralytics predictor(fuse 된 가중치)도 load_models 에서 부모가 미리 만듦
+# - 부모에서 gc.freeze() → 로드된 객체를 GC 추적 대상에서 빼서 워커의 GC 가 페이지를 건드려 복사되는 일 방지
+# - 워커마다 torch/OpenCV 스레드 수를 코어 / 워커 수로 제한해 과다 구독 방지
+# - 각 워커는 기동 후 백그라운드에서 warm-up, 끝나면 /readyz 가 200
+# gunicorn 은 fork 기반이라 Linux/macOS 전용 (Windows 개발 환경은 python main.py)
+workers = int(os.environ.get("MUSESCAN_WORKERS", os.cpu_count() or 1))
+threads_per_worker = int(os.environ.get("MUSESCAN_THREADS", max(1, (os.cpu_count() or 1) // workers)))
+
+bind = os.environ.get("MUSESCAN_BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# 큰 페이지/다중 페이지 문서는 수십 초 이상 걸림
+timeout = int(os.environ.get("MUSESCAN_TIMEOUT", 300))
+graceful_timeout = 30
+keepalive = 5
+
+# torch/OpenMP 는 import 시점에 스레드 수를 정하므로 앱을 preload 하기 전에 설정
+for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(var, str(threads_per_worker))
+
+
+def when_ready(server):
+    # 모델 로드가 끝난 부모 프로세스, 워커 fork 직전
+    gc.freeze()
+    server.log.info(f"Models preloaded, forking {workers} workers × {threads_per_worker} threads")
+
+
+def post_fork(server, worker):
+    import cv2
+    import torch
+    torch.set_num_threads(threads_per_worker)
+    cv2.setNumThreads(threads_per_worker)
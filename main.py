@@ -1,24 +1,25 @@
-from fastapi import FastAPI, File, UploadFile
+from typing import List
+from fastapi import FastAPI, File, Form, UploadFile, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import HTTPException
-from fastapi.responses import FileResponse
-import subprocess
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
 import os, sys
-import cv2
-import numpy as np
-from tempfile import NamedTemporaryFile
-from ultralytics import YOLO
-from yolo_detection.data_preprocess import (
-    remove_staff_lines,
-    split_image_with_offsets,
-    run_yolo_on_patches,
-    restore_to_original_coords,
-    apply_nms,
-    draw_final_boxes
-)
-from yolo_detection.midi_extract import convert_boxes_to_midi_from_heads
-from midi2audio import FluidSynth
-from pydub import AudioSegment
+import json
+import queue
+import shutil
+import zipfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import quote
+from storage import ResultStore
+from yolo_detection.document import is_multipage, is_prebinarized, image_pixels, iter_pages
+from yolo_detection.pipeline import load_models, warm_up, render_events
+from yolo_detection.staged import build_page_pipeline, submit_page, process_document_staged
+from yolo_detection.midi_extract import DEFAULT_TEMPO, DEFAULT_PROGRAM, DEFAULT_VELOCITY, write_midi
+from yolo_detection.windowed import process_page_windowed
 
 app = FastAPI()
 
@@ -32,124 +33,475 @@ app.add_middleware(
 
 os.environ["PATH"] += os.pathsep + "E:/Downloads/fluidsynth-2.4.6-win10-x64/bin"
 
-# 모델 및 사운드폰트 경로
-MODEL_PATH = "best/x_best.pt"
-SOUNDFONT_PATH = "FluidR3_GM.sf2"
-
-model = YOLO(MODEL_PATH)
+# 모델 경로는 yolo_detection/onnx_backend.py, 사운드폰트 경로는 yolo_detection/pipeline.py
+# MUSESCAN_BACKEND=onnx|onnx-int8|openvino 로 CPU 추론 백엔드 선택 (기본 torch)
+# import 시점에 note/head 모델을 모두 로드 → gunicorn preload_app 이면 부모에서 한 번만 로드 후 워커가 공유
+# (predictor 생성·Conv/BN fuse 까지 부모에서 끝내므로 워커의 첫 추론이 가중치 사본을 만들지 않음)
+model, head_model = load_models()
 class_names = model.names
-TMP_WAV = "temp.wav"
-
-# MIDI → MP3 변환 함수
-def midi_to_mp3(midi_path, mp3_path):
-    if not os.path.exists(SOUNDFONT_PATH):
-        raise FileNotFoundError(f"SoundFont not found: {SOUNDFONT_PATH}")
-    if not os.path.exists(midi_path):
-        raise FileNotFoundError(f"MIDI file not found: {midi_path}")
-
-    # fluidsynth 명령어 직접 실행
-    cmd = [
-        "fluidsynth",
-        "-ni",
-        "-F", TMP_WAV,
-        "-r", "44100",
-        SOUNDFONT_PATH,
-        midi_path
-    ]
-    try:
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"fluidsynth execution failed: {e}")
 
-    if not os.path.exists(TMP_WAV):
-        raise RuntimeError("WAV file not created. fluidsynth failed silently.")
+# 이 픽셀 수 이상인 단일 이미지는 windowed(band 단위) 모드로 처리
+WINDOWED_MIN_PIXELS = int(os.environ.get("MUSESCAN_WINDOWED_MIN_PIXELS", 40_000_000))
+# MUSESCAN_DEBUG=1 이면 cropped_notes/, debug_pitch_overlay.png 디버그 파일도 저장
+DEBUG_DUMPS = os.environ.get("MUSESCAN_DEBUG") == "1"
 
-    # pydub로 mp3 인코딩
-    audio = AudioSegment.from_wav(TMP_WAV)
-    audio.export(mp3_path, format="mp3")
+# 결과 저장소: TTL/용량 한도 기반 자동 정리 + 원자적 게시
+store = ResultStore()
 
-    os.remove(TMP_WAV)
+# 단계별 파이프라인: 동시에 들어온 페이지/요청의 전처리·추론·합성을 겹쳐 실행
+# 단계별 워커 수는 MUSESCAN_STAGE_WORKERS (예: "prepare=4,audio=3"), 큐 크기는 MUSESCAN_STAGE_QUEUE
+# note/head 모델 잠금은 파이프라인 단계, windowed 처리, warm-up 이 함께 사용 (동시 추론 방지)
+model_lock, head_lock = threading.Lock(), threading.Lock()
+page_pipeline = build_page_pipeline(model, head_model, model_lock=model_lock, head_lock=head_lock)
+# 배치 요청 안의 대형 스캔(windowed)은 별도 스레드에서 하나씩 처리 → 생산자 스레드가 막히지 않고
+# 뒤 파일들을 계속 파이프라인에 투입 (스레드는 첫 submit 때 워커 프로세스에서 생성)
+windowed_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="windowed")
 
-# 이미지 처리 → MIDI 및 MP3 생성
-def process_image_and_generate_audio(image_bytes: bytes, filename: str):
-    with NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
-        tmp_file.write(image_bytes)
-        tmp_path = tmp_file.name
+# 워커별 준비 상태: 프로세스는 떠 있지만(liveness) warm-up 전에는 트래픽을 받지 않도록(readiness)
+# 워커의 warm-up 은 워커 스레드 수로 한 번 더 추론해 스레드 풀/할당자만 데움 (가중치는 부모와 공유)
+ready = threading.Event()
 
-    image = cv2.imread(tmp_path)
-    cleaned = remove_staff_lines(image)
+def warm_up_worker():
+    try:
+        with model_lock, head_lock:
+            warm_up(model, head_model)
+        ready.set()
+        print(f"[🔥] Worker {os.getpid()} warmed up")
+    except Exception as e:
+        print(f"[❌] Warm-up failed in worker {os.getpid()}: {e}")
+
+@app.on_event("startup")
+def start_result_store():
+    store.start()
+    page_pipeline.start()
+    threading.Thread(target=warm_up_worker, name="model-warm-up", daemon=True).start()
 
-    patch_size = (640, 640)
-    stride = (480, 480)
-    patches, positions = split_image_with_offsets(cleaned, patch_size, stride)
+@app.on_event("shutdown")
+def stop_result_store():
+    windowed_pool.shutdown(wait=True, cancel_futures=True)
+    page_pipeline.stop()
+    store.stop()
 
-    results = run_yolo_on_patches(model, patches, conf=0.25)
-    restored = restore_to_original_coords(results, positions, patch_size)
-    merged_boxes = apply_nms(restored, iou_thresh=0.5)
+def publish(path, job_id):
+    if not path:
+        return None
+    return f"/download/{store.publish(path, job_id)}"
 
-    result_img_path = f"sample_detected/{filename}_detected.png"
-    os.makedirs(os.path.dirname(result_img_path), exist_ok=True)
-    cv2.imwrite(result_img_path, draw_final_boxes(image.copy(), merged_boxes, class_names))
+# 이미지/문서 처리 → MIDI 및 MP3 생성 (페이지가 끝날 때마다 이벤트를 내보냄)
+def process_upload(contents: bytes, filename: str, prebinarized: bool = False):
+    # 결과는 작업별 staging 폴더에 만든 뒤 완성된 파일만 저장소에 게시
+    # prebinarized: 클라이언트가 이미 축소·이진화한 이미지 (1-bit PNG는 헤더로 자동 판별)
+    job_id, work_dir = store.staging_dir()
+    debug = {"crop_dir": "cropped_notes", "debug_path": "debug_pitch_overlay.png"} if DEBUG_DUMPS else {}
+    try:
+        if not is_multipage(contents):
+            if image_pixels(contents) >= WINDOWED_MIN_PIXELS:
+                # 대형 스캔은 band 단위 처리 (전체 페이지 사본을 만들지 않음)
+                tmp_path = os.path.join(work_dir, "source.png")
+                with open(tmp_path, "wb") as f:
+                    f.write(contents)
+                result = process_page_windowed(tmp_path, filename, work_dir, model, head_model,
+                                               model_lock=model_lock, head_lock=head_lock)
+            else:
+                # 디코딩도 파이프라인의 prepare 단계에서 수행
+                result = submit_page(page_pipeline, filename, work_dir, data=contents,
+                                     grayscale=prebinarized or is_prebinarized(contents), **debug).result()
+            preview = publish(result["preview_image"], job_id)
+            midi_url = publish(result["midi_file"], job_id)
+            events_url = publish(result["events_file"], job_id)
+            yield {"type": "page", "page": 1, "pages": 1,
+                   "preview_image": preview, "midi_file": midi_url, "events_file": events_url}
+            yield {"type": "done", "pages": 1, "preview_image": preview,
+                   "midi_file": midi_url, "mp3_file": publish(result["mp3_file"], job_id),
+                   "events_file": events_url}
+            return
 
-    output_midi = f"sample_detected/{filename}.mid"
-    convert_boxes_to_midi_from_heads(merged_boxes, image, output_midi)
+        first_preview = None
+        for event in process_document_staged(contents, filename, work_dir, page_pipeline, **debug):
+            if event["type"] == "page":
+                preview = publish(event["preview_image"], job_id)
+                first_preview = first_preview or preview
+                print(f"[📄] Page {event['page']}/{event['pages']} done")
+                yield {"type": "page", "page": event["page"], "pages": event["pages"],
+                       "preview_image": preview, "midi_file": publish(event["midi_file"], job_id),
+                       "events_file": publish(event["events_file"], job_id)}
+            else:
+                yield {"type": "done", "pages": event["pages"], "preview_image": first_preview,
+                       "midi_file": publish(event["midi_file"], job_id),
+                       "mp3_file": publish(event["mp3_file"], job_id),
+                       "events_file": publish(event["events_file"], job_id)}
+    finally:
+        store.discard_staging(job_id)
 
-    output_mp3 = f"sample_detected/{filename}.mp3"
-    midi_to_mp3(output_midi, output_mp3)
+# 상태 확인: liveness(프로세스 응답 여부) / readiness(모델 warm-up 완료 여부)
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok", "pid": os.getpid()}
 
-    return result_img_path, output_midi, output_mp3
+@app.get("/readyz")
+def readyz():
+    if not ready.is_set():
+        return Response(content=json.dumps({"status": "warming_up", "pid": os.getpid()}),
+                        status_code=503, media_type="application/json")
+    return {"status": "ready", "pid": os.getpid(), "store": store.stats()}
+
+# 단계별 대기열 깊이 / 처리 중 워커 / 평균 처리 시간 (단계별 워커 수 조정용, 워커 프로세스 단위)
+@app.get("/stats/pipeline")
+def pipeline_stats():
+    return {"pid": os.getpid(), "stages": page_pipeline.stats()}
 
 # 업로드 API
 @app.post("/upload/")
-async def upload_image(file: UploadFile = File(...)):
+async def upload_image(file: UploadFile = File(...), prebinarized: bool = Form(False)):
     print(f"[✅] Received file: {file.filename}")
 
     contents = await file.read()
     filename = os.path.splitext(file.filename)[0]
 
     try:
-        result_img, midi_path, mp3_path = process_image_and_generate_audio(contents, filename)
+        pages = []
+        done = {}
+        for event in await run_in_threadpool(list, process_upload(contents, filename, prebinarized)):
+            if event["type"] == "page":
+                pages.append(event)
+            else:
+                done = event
         print(f"[🎯] Files saved:")
-        print(f"    ➤ Result image : {result_img}")
-        print(f"    ➤ MIDI         : {midi_path}")
-        print(f"    ➤ MP3          : {mp3_path}")
-        
+        print(f"    ➤ Result image : {done['preview_image']}")
+        print(f"    ➤ MIDI         : {done['midi_file']}")
+        print(f"    ➤ MP3          : {done['mp3_file']}")
+
         return {
-            "midi_file": f"/download/{os.path.basename(midi_path)}",
-            "mp3_file": f"/download/{os.path.basename(mp3_path)}",
-            "preview_image": f"/download/{os.path.basename(result_img)}"
+            "midi_file": done["midi_file"],
+            "mp3_file": done["mp3_file"],
+            "preview_image": done["preview_image"],
+            "events_file": done["events_file"],
+            "pages": pages
         }
     except Exception as e:
         print(f"[❌] Upload processing error: {e}")
         return {"error": str(e)}
 
+# 스트리밍 업로드 API: 페이지별 결과를 NDJSON 한 줄씩 바로 전송
+@app.post("/upload/stream")
+async def upload_stream(file: UploadFile = File(...), prebinarized: bool = Form(False)):
+    print(f"[✅] Received file (stream): {file.filename}")
+
+    contents = await file.read()
+    filename = os.path.splitext(file.filename)[0]
+
+    def events():
+        try:
+            for event in process_upload(contents, filename, prebinarized):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"[❌] Upload processing error: {e}")
+            yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+
+    # 동기 generator는 threadpool에서 실행되므로 이벤트 루프를 막지 않음
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+# 일괄 업로드 API: 여러 파일의 모든 페이지를 한꺼번에 파이프라인에 넣고,
+# 끝나는 순서대로 페이지별 MIDI/미리보기를 ZIP에 추가해 바로 전송 (ZIP 전체를 메모리에 만들지 않음)
+# ZIP 구성: <번호>_<파일명>/p001.mid, p001_detected.png ... + combined.mid(입력 순서) + manifest.json
+class ZipSink:
+    # zipfile 이 쓴 바이트를 모아 두었다가 generator 가 꺼내 보냄
+    # seek/tell 이 없으므로 zipfile 은 항목마다 data descriptor 를 붙여 순차 기록
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def failed_future(error):
+    future = Future()
+    future.set_exception(error)
+    return future
+
+def submit_batch(sources, work_dir, completed, cancelled, debug):
+    # 생산자 스레드: 파일을 하나씩 읽어 페이지 단위로 투입 (첫 단계 큐가 차면 대기 → 메모리 제한)
+    # 완료된 페이지는 completed 큐로, 마지막에 전체 페이지 수를 넣어 종료를 알림
+    count = 0
+
+    def track(key, future):
+        nonlocal count
+        count += 1
+        future.add_done_callback(lambda f: completed.put((key, f)))
+
+    def windowed(path, name):
+        # 요청이 취소되면(클라이언트 연결 종료) 아직 시작하지 않은 대형 스캔은 건너뜀
+        if cancelled.is_set():
+            raise RuntimeError("Batch cancelled")
+        return process_page_windowed(path, name, work_dir, model, head_model, audio=False,
+                                     model_lock=model_lock, head_lock=head_lock)
+
+    try:
+        for stem, path in sources:
+            if cancelled.is_set():
+                break
+            with open(path, "rb") as f:
+                contents = f.read()
+            os.remove(path)
+            try:
+                if is_multipage(contents):
+                    for index, image in iter_pages(contents):
+                        if cancelled.is_set():
+                            break
+                        track((stem, index + 1), submit_page(page_pipeline, f"{stem}_p{index + 1:03}", work_dir,
+                                                             image=image, audio=False, cancelled=cancelled,
+                                                             **debug))
+                        del image
+                elif image_pixels(contents) >= WINDOWED_MIN_PIXELS:
+                    path = os.path.join(work_dir, f"{stem}_source.png")
+                    with open(path, "wb") as f:
+                        f.write(contents)
+                    track((stem, 1), windowed_pool.submit(windowed, path, f"{stem}_p001"))
+                else:
+                    track((stem, 1), submit_page(page_pipeline, f"{stem}_p001", work_dir, data=contents,
+                                                 grayscale=is_prebinarized(contents), audio=False,
+                                                 cancelled=cancelled, **debug))
+            except Exception as e:
+                track((stem, 0), failed_future(e))
+    finally:
+        completed.put(count)
+
+def finish_batch(completed, done, total, job_id):
+    # 남은 페이지가 모두 끝나거나 취소될 때까지 기다린 뒤 staging 폴더 삭제
+    # (실행 중인 단계가 지워진 폴더에 쓰지 않도록, 생산자는 마지막에 전체 페이지 수를 넣고 종료)
+    while total is None or done < total:
+        item = completed.get()
+        if isinstance(item, int):
+            total = item
+        else:
+            done += 1
+    store.discard_staging(job_id)
+
+def stream_batch(sources, job_id, work_dir):
+    debug = {"crop_dir": "cropped_notes", "debug_path": "debug_pitch_overlay.png"} if DEBUG_DUMPS else {}
+    completed = queue.Queue()
+    cancelled = threading.Event()
+    producer = threading.Thread(target=submit_batch, args=(sources, work_dir, completed, cancelled, debug),
+                                name=f"batch-{job_id}", daemon=True)
+    producer.start()
+
+    sink = ZipSink()
+    notes = {}
+    manifest = []
+    done, total = 0, None
+    try:
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+            while total is None or done < total:
+                item = completed.get()
+                if isinstance(item, int):
+                    total = item
+                    continue
+                (stem, page), future = item
+                done += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"[❌] Batch page failed: {stem} p{page}: {e}")
+                    manifest.append({"file": stem, "page": page, "status": "error", "error": str(e)})
+                    continue
+
+                notes[(stem, page)] = result["notes"]
+                midi_name = f"{stem}/p{page:03}.mid"
+                preview_name = f"{stem}/p{page:03}_detected.png"
+                zf.write(result["midi_file"], midi_name)
+                zf.write(result["preview_image"], preview_name, compress_type=zipfile.ZIP_STORED)
+                for key in ("midi_file", "preview_image", "events_file"):
+                    os.remove(result[key])
+                manifest.append({"file": stem, "page": page, "status": "ok", "midi_file": midi_name,
+                                 "preview_image": preview_name, "boxes": result["boxes"],
+                                 "timings": result["timings"]})
+                print(f"[📦] Batch page {done}/{total or '?'} done: {stem} p{page}")
+                yield sink.drain()
+
+            # 합쳐진 MIDI는 완료 순서가 아니라 입력 파일/페이지 순서대로
+            combined = os.path.join(work_dir, "combined.mid")
+            write_midi([notes[key] for key in sorted(notes)], combined)
+            zf.write(combined, "combined.mid")
+            manifest.sort(key=lambda m: (m["file"], m["page"]))
+            zf.writestr("manifest.json", json.dumps({"pages": manifest}, ensure_ascii=False, indent=1))
+        yield sink.drain()
+    finally:
+        # 클라이언트 연결이 끊기면 제너레이터가 닫히며 여기로 옴 → 남은 job 은 단계마다 취소되고,
+        # 정리는 백그라운드에서 기다림 (요청 스레드를 막지 않음)
+        cancelled.set()
+        if total is not None and done >= total:
+            store.discard_staging(job_id)
+        else:
+            threading.Thread(target=finish_batch, args=(completed, done, total, job_id),
+                             name=f"batch-{job_id}-cleanup", daemon=True).start()
+
+@app.post("/upload/batch")
+async def upload_batch(files: List[UploadFile] = File(...)):
+    print(f"[✅] Received batch: {len(files)} files")
+    # 업로드 파일은 응답 스트리밍 중에 닫힐 수 있으므로 먼저 staging 폴더로 복사 (메모리에 모두 올리지 않음)
+    job_id, work_dir = store.staging_dir()
+    sources = []
+    for index, file in enumerate(files):
+        stem = f"{index + 1:03}_{os.path.splitext(os.path.basename(file.filename or 'page'))[0]}"
+        path = os.path.join(work_dir, f"{stem}.upload")
+        with open(path, "wb") as f:
+            await run_in_threadpool(shutil.copyfileobj, file.file, f)
+        sources.append((stem, path))
+
+    return StreamingResponse(stream_batch(sources, job_id, work_dir), media_type="application/zip",
+                             headers={"Content-Disposition": 'attachment; filename="musescan_batch.zip"'})
+
+# 재렌더링 API: 업로드 결과의 events_file(note 이벤트)로 템포/악기/세기만 바꿔 MIDI·MP3 재생성
+# 이미지 처리나 모델 추론 없이 저장된 이벤트만 사용
+EVENTS_SUFFIX = ".events.json"
+
+class RenderRequest(BaseModel):
+    events_file: str  # /upload 응답의 events_file ("/download/<이름>") 또는 게시 이름
+    tempo: float = Field(DEFAULT_TEMPO, gt=0, le=400)  # BPM
+    program: int = Field(DEFAULT_PROGRAM, ge=0, le=127)  # General MIDI 악기 번호
+    velocity: int = Field(DEFAULT_VELOCITY, ge=1, le=127)
+    audio: bool = True
+
+@app.post("/render")
+def render(request: RenderRequest):
+    meta = store.resolve(os.path.basename(request.events_file))
+    if meta is None or not meta["filename"].endswith(EVENTS_SUFFIX):
+        raise HTTPException(status_code=404, detail="Note events not found")
+
+    stem = meta["filename"][:-len(EVENTS_SUFFIX)]
+    name = f"{stem}_t{request.tempo:g}_p{request.program}_v{request.velocity}"
+    job_id, work_dir = store.staging_dir()
+    try:
+        result = render_events(meta["path"], name, work_dir, request.tempo, request.program,
+                               request.velocity, request.audio)
+        return {
+            "midi_file": publish(result["midi_file"], job_id),
+            "mp3_file": publish(result["mp3_file"], job_id),
+            "duration": result["duration"],
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    finally:
+        store.discard_staging(job_id)
+
 
 # 파일 다운로드 엔드포인트
+MEDIA_TYPES = {".mp3": "audio/mpeg", ".mid": "audio/midi", ".png": "image/png", ".json": "application/json"}
+# 게시 이름이 내용 해시를 포함하므로 같은 URL의 내용은 바뀌지 않음 → 1년 캐시
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+DOWNLOAD_CHUNK = 64 * 1024
+
+def open_result(meta):
+    # 본문을 보낼 때만 파일을 엶 (304 는 파일시스템 접근 없음)
+    # 다른 워커(정리 담당)가 이미 삭제한 파일이면 이 워커의 인덱스에서도 빼고 404
+    try:
+        return open(meta["path"], "rb")
+    except FileNotFoundError:
+        store.remove(meta["name"])
+        print(f"[❌] File not found: {meta['name']}")
+        raise HTTPException(status_code=404, detail="File not found")
+
+def iter_file(f, start, length):
+    # f: open_result 로 미리 연 파일 → 응답 헤더를 보낸 뒤에 파일이 없어지는 경우가 없음
+    with f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(DOWNLOAD_CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def content_disposition(filename):
+    # FileResponse 와 같은 규칙: ASCII 가 아닌 이름(한글 등)은 RFC 5987 filename* 로 인코딩
+    # (헤더는 latin-1 로 인코딩되므로 원본 이름을 그대로 넣으면 500)
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return 'attachment; filename="{}"'.format(filename.replace("\\", "\\\\").replace('"', '\\"'))
+
+def etag_matches(header, etag):
+    if header.strip() == "*":
+        return True
+    tags = [t.strip() for t in header.split(",")]
+    return etag in tags or f"W/{etag}" in tags
+
+RANGE_NOT_SATISFIABLE = object()
+
+def parse_range(header, size):
+    # 단일 범위만 지원: bytes=a-b / bytes=a- / bytes=-n → (start, end)
+    # 모르는 단위·다중 범위·형식 오류 → None (RFC 9110: 헤더를 무시하고 200 전체 응답)
+    # 형식은 맞지만 파일 범위 밖 → RANGE_NOT_SATISFIABLE (416)
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    first, last = first.strip(), last.strip()
+    if not sep or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+        return None
+    if first == "":
+        if last == "":
+            return None
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            return RANGE_NOT_SATISFIABLE
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and start > int(last):
+        return None
+    if start >= size:
+        return RANGE_NOT_SATISFIABLE
+    return start, min(end, size - 1)
+
 @app.get("/download/{filename}")
-def download_file(filename: str):
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(base_dir, "sample_detected", filename)
-    
-    print(f"[📥] Download requested: {filename}")
-    print(f"[🧭] Resolved path: {file_path}")
-
-    if not os.path.exists(file_path):
-        print("[❌] File not found")
+def download_file(filename: str, request: Request):
+    meta = store.resolve(filename)
+    if meta is None:
+        print(f"[❌] File not found: {filename}")
         raise HTTPException(status_code=404, detail="File not found")
-    
-    print("[✅] File exists, sending response.")
-    
-    media_type = "application/octet-stream"
-    if filename.endswith(".mp3"):
-        media_type = "audio/mpeg"
-    elif filename.endswith(".mid"):
-        media_type = "audio/midi"
-    elif filename.endswith(".png"):
-        media_type = "image/png"
 
-    return FileResponse(file_path, media_type=media_type, filename=filename)
+    size = meta["size"]
+    etag = f'"{meta["etag"]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE,
+        "Accept-Ranges": "bytes",
+        "Last-Modified": formatdate(meta["created"], usegmt=True),
+        "Content-Disposition": content_disposition(meta["filename"]),
+    }
+    media_type = MEDIA_TYPES.get(os.path.splitext(filename)[1], "application/octet-stream")
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = parse_range(range_header, size)
+        if byte_range is RANGE_NOT_SATISFIABLE:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(length)})
+            return StreamingResponse(iter_file(open_result(meta), start, length), status_code=206,
+                                     media_type=media_type, headers=headers)
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(iter_file(open_result(meta), 0, size), media_type=media_type, headers=headers)
 
 
 if __name__ == "__main__":
+    # 개발용 단일 프로세스 (파일 변경 시 자동 재시작). 운영: python musescan.py serve
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
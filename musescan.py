@@ -0,0 +1,239 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".pdf")
+
+# ------------------------
+# 워커 프로세스 (워커당 모델 1벌)
+# ------------------------
+_worker = {}
+
+def _init_worker(backend, threads):
+    # 코어를 워커 수로 나눠 쓰도록 torch/OpenCV 스레드 수 제한
+    import cv2
+    import torch
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+    from yolo_detection.pipeline import load_models
+    _worker['model'], _worker['head_model'] = load_models(backend)
+
+def _page_record(source, page, pages, name, process):
+    record = {"source": source, "page": page, "pages": pages, "name": name, "pid": os.getpid()}
+    start = time.perf_counter()
+    try:
+        result = process()
+        result.pop("notes")
+        record.update(status="ok", outputs={
+            "preview_image": result["preview_image"],
+            "midi_file": result["midi_file"],
+            "mp3_file": result["mp3_file"],
+            "events_file": result["events_file"],
+        }, boxes=result["boxes"], head_stats=result["head_stats"], timings=result["timings"])
+    except Exception as e:
+        record.update(status="error", error=str(e))
+    record["elapsed"] = time.perf_counter() - start
+    return record
+
+def _process_one(source, name, output_dir, audio, windowed=False):
+    # 반환: 페이지별 레코드 목록 (다중 페이지 PDF/TIFF 는 업로드 경로와 같이 페이지마다 하나씩)
+    import cv2
+    from yolo_detection.pipeline import process_page
+    from yolo_detection.windowed import process_page_windowed
+    from yolo_detection.document import is_multipage, iter_pages, page_count
+
+    model, head_model = _worker['model'], _worker['head_model']
+
+    def single_page():
+        if windowed:
+            return process_page_windowed(source, name, output_dir, model, head_model, audio=audio)
+        image = cv2.imread(source)
+        if image is None:
+            raise ValueError(f"Could not decode image: {source}")
+        return process_page(image, name, output_dir, model, head_model, audio=audio)
+
+    try:
+        # 헤더만 읽어 판별 → 단일 이미지(특히 windowed 대형 스캔)는 바이트를 메모리에 올리지 않음
+        with open(source, "rb") as f:
+            multipage = is_multipage(f.read(8))
+        if not multipage:
+            return [_page_record(source, 1, 1, name, single_page)]
+        with open(source, "rb") as f:
+            data = f.read()
+        pages = page_count(data)
+        records = []
+        for index, image in iter_pages(data):
+            page_name = f"{name}_p{index + 1:03}"
+            records.append(_page_record(source, index + 1, pages, page_name,
+                                        lambda: process_page(image, page_name, output_dir, model, head_model,
+                                                             audio=audio)))
+            del image
+        return records
+    except Exception as e:  # 문서 열기/래스터화 실패
+        return [{"source": source, "page": 0, "pages": None, "name": name, "pid": os.getpid(),
+                 "status": "error", "error": str(e), "elapsed": 0.0}]
+
+# ------------------------
+# 입력 수집 및 이어하기(resume)
+# ------------------------
+def collect_sources(input_path):
+    if os.path.isdir(input_path):
+        root = input_path
+        paths = [os.path.join(dp, f) for dp, _, files in os.walk(input_path) for f in files]
+    else:
+        paths = glob.glob(input_path, recursive=True)
+        root = os.path.commonpath(paths) if paths else "."
+        if os.path.isfile(root):
+            root = os.path.dirname(root)
+    paths = sorted(p for p in paths if p.lower().endswith(IMAGE_EXTS))
+    return root, paths
+
+def output_name(path, root):
+    # 하위 폴더/확장자가 달라도 이름이 겹치지 않도록 상대 경로와 확장자를 이름에 반영
+    # (scan.png → scan_png, scan.jpg → scan_jpg)
+    stem, ext = os.path.splitext(os.path.relpath(path, root))
+    name = f"{stem}_{ext.lstrip('.')}" if ext else stem
+    return name.replace(os.sep, "__").replace("/", "__")
+
+def source_signature(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime": int(st.st_mtime)}
+
+def load_completed(manifest_path):
+    completed = {}
+    if not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 중단된 실행이 남긴 마지막 줄
+            if record.get("status") == "ok":
+                # 입력 파일별 {페이지 번호: 레코드} (page 필드가 없는 예전 레코드는 1페이지짜리)
+                completed.setdefault(record["source"], {})[record.get("page", 1)] = record
+    return completed
+
+def is_done(records, path, audio=False):
+    # 현재 파일 내용으로 처리한 모든 페이지가 성공했고,
+    # 이번 실행에 필요한 출력이 모두 있어야 완료 (이전에 --audio 없이 처리했다면 MP3 가 없으므로 다시 처리)
+    signature = source_signature(path)
+    pages = {n: r for n, r in (records or {}).items() if r.get("signature") == signature}
+    if not pages:
+        return False
+    total = next(iter(pages.values())).get("pages", 1)
+    if set(pages) != set(range(1, total + 1)):
+        return False
+    required = ["preview_image", "midi_file", "events_file"] + (["mp3_file"] if audio else [])
+    return all(r.get("outputs", {}).get(key) is not None and os.path.exists(r["outputs"][key])
+               for r in pages.values() for key in required)
+
+# ------------------------
+# batch 명령
+# ------------------------
+def run_batch(args):
+    root, sources = collect_sources(args.input)
+    if not sources:
+        print(f"[❌] No images found: {args.input}")
+        return 1
+
+    os.makedirs(args.output, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.output, "manifest.jsonl")
+    completed = {} if args.no_resume else load_completed(manifest_path)
+    todo = [p for p in sources if not is_done(completed.get(p), p, args.audio)]
+    print(f"[INFO] {len(sources)} files found, {len(sources) - len(todo)} already done, {len(todo)} to process")
+    if not todo:
+        return 0
+
+    workers = args.workers or os.cpu_count() or 1
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+    start = time.perf_counter()
+    ok = failed = done = 0
+
+    with open(manifest_path, "a", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(args.backend, threads)) as pool:
+        futures = {
+            pool.submit(_process_one, path, output_name(path, root), args.output, args.audio,
+                        args.windowed): path
+            for path in todo
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                records = future.result()
+            except Exception as e:  # 워커 프로세스 자체가 죽은 경우
+                records = [{"source": path, "page": 0, "status": "error", "error": repr(e)}]
+            signature = source_signature(path)
+            done += 1
+            for record in records:
+                record["signature"] = signature
+                manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+                page = f" p{record['page']}/{record['pages']}" if (record.get("pages") or 1) > 1 else ""
+                if record["status"] == "ok":
+                    ok += 1
+                    print(f"[✅ {done}/{len(todo)}] {path}{page} ({record['elapsed']:.1f}s)")
+                else:
+                    failed += 1
+                    print(f"[❌ {done}/{len(todo)}] {path}{page}: {record['error']}")
+            manifest.flush()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n[🎯] {ok} ok, {failed} failed in {elapsed:.1f}s "
+          f"({ok / elapsed * 60 if elapsed else 0:.1f} pages/min, {workers} workers × {threads} threads)")
+    print(f"    ➤ Manifest : {manifest_path}")
+    return 0 if failed == 0 else 2
+
+
+# ------------------------
+# 운영 서버 (gunicorn + UvicornWorker, 모델 preload 후 fork)
+# ------------------------
+def run_serve(args):
+    # 설정은 gunicorn.conf.py 가 환경 변수로 읽음 → 여기서는 옵션을 환경 변수로 넘기고 gunicorn 으로 교체
+    env = {"MUSESCAN_WORKERS": args.workers, "MUSESCAN_THREADS": args.threads,
+           "MUSESCAN_BIND": args.bind, "MUSESCAN_BACKEND": args.backend}
+    for key, value in env.items():
+        if value is not None:
+            os.environ[key] = str(value)
+    root = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(root)
+    argv = [sys.executable, "-m", "gunicorn", "-c", os.path.join(root, "gunicorn.conf.py"), "main:app"]
+    print(f"[🚀] {' '.join(argv[1:])}")
+    os.execv(sys.executable, argv)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="musescan", description="MuseScan 악보 → MIDI 변환 도구")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    batch = sub.add_parser("batch", help="폴더/글롭의 악보 이미지를 일괄 변환")
+    batch.add_argument("input", help="입력 폴더 또는 글롭 (예: 'scans/**/*.png')")
+    batch.add_argument("-o", "--output", default="batch_output")
+    batch.add_argument("-j", "--workers", type=int, default=None, help="워커 프로세스 수 (기본: CPU 코어 수)")
+    batch.add_argument("--threads", type=int, default=None, help="워커당 torch 스레드 수 (기본: 코어 / 워커)")
+    batch.add_argument("--backend", default=None, help="torch | onnx | onnx-int8 | openvino")
+    batch.add_argument("--audio", action="store_true", help="MP3까지 생성")
+    batch.add_argument("--manifest", default=None, help="JSONL 매니페스트 경로 (기본: <output>/manifest.jsonl)")
+    batch.add_argument("--windowed", action="store_true",
+                       help="대형 스캔: band 단위로 읽어 페이지 크기와 무관한 메모리로 처리")
+    batch.add_argument("--no-resume", action="store_true", help="완료된 페이지도 다시 처리")
+    batch.set_defaults(func=run_batch)
+
+    serve = sub.add_parser("serve", help="운영 서버 실행 (모델을 한 번 로드한 뒤 워커 N개로 fork)")
+    serve.add_argument("-w", "--workers", type=int, default=None, help="워커 프로세스 수 (기본: CPU 코어 수)")
+    serve.add_argument("--threads", type=int, default=None, help="워커당 torch 스레드 수 (기본: 코어 / 워커)")
+    serve.add_argument("-b", "--bind", default=None, help="바인드 주소 (기본: 0.0.0.0:8000)")
+    serve.add_argument("--backend", default=None, help="torch | onnx | onnx-int8 | openvino")
+    serve.set_defaults(func=run_serve)
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
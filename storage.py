@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows 개발 환경: 단일 프로세스이므로 잠금 불필요
+    fcntl = None
+
+# ------------------------
+# 결과 파일 저장소 (sample_detected/)
+# ------------------------
+# - 해시 prefix 로 디렉터리 분산: root/ab/cd/<name>
+# - 결과별 메타데이터(크기, 마지막 접근 시각, 작업 ID)를 메모리 인덱스로 관리
+# - 작업 중 파일은 root/.staging/<job>/ 에 쓰고 완료 후 os.replace 로 게시 → 반쯤 쓰인 파일은 노출되지 않음
+# - 백그라운드 스레드가 TTL / 전체 용량 한도 기준으로 오래된 결과부터 삭제
+#   다중 워커(gunicorn)에서는 root/.evictor.lock 을 잡은 한 프로세스만 정리를 수행하고,
+#   각 워커는 메모리에 모아 둔 마지막 접근 시각을 정리 주기마다 파일 atime(os.utime)으로 기록
+#   → 다운로드 요청마다 파일시스템을 건드리지 않으면서 모든 워커의 접근이 정리에 반영됨
+# - 게시 이름에 내용 해시를 포함(content-addressed) → 같은 이름은 항상 같은 내용이라 장기 캐시 가능
+RESULT_ROOT = os.environ.get("MUSESCAN_RESULT_DIR", "sample_detected")
+RESULT_TTL = float(os.environ.get("MUSESCAN_RESULT_TTL", 24 * 3600))
+RESULT_MAX_BYTES = int(os.environ.get("MUSESCAN_RESULT_MAX_BYTES", 5 * 1024 ** 3))
+EVICT_INTERVAL = 60
+INDEX_FILE = "index.json"
+EVICTOR_LOCK = ".evictor.lock"
+STAGING_DIR = ".staging"
+HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def content_name(filename, sha256):
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}-{sha256[:16]}{ext}"
+
+def split_content_name(name):
+    # content_name 의 역: (원래 파일 이름, 내용 해시 앞 16자리) / 형식이 다르면 (name, None)
+    stem, ext = os.path.splitext(name)
+    base, _, digest = stem.rpartition("-")
+    if base and len(digest) == 16 and all(c in "0123456789abcdef" for c in digest):
+        return base + ext, digest
+    return name, None
+
+
+class ResultStore:
+    def __init__(self, root=RESULT_ROOT, ttl=RESULT_TTL, max_bytes=RESULT_MAX_BYTES,
+                 interval=EVICT_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._index = {}
+        self._total = 0
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._evictor_lock = None
+        self._touched = set()
+        os.makedirs(os.path.join(self.root, STAGING_DIR), exist_ok=True)
+        self._load()
+
+    # ---------- 경로 ----------
+    def shard_path(self, name):
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], name)
+
+    def staging_dir(self, job_id=None):
+        job_id = job_id or uuid.uuid4().hex
+        path = os.path.join(self.root, STAGING_DIR, job_id)
+        os.makedirs(path, exist_ok=True)
+        return job_id, path
+
+    def discard_staging(self, job_id):
+        shutil.rmtree(os.path.join(self.root, STAGING_DIR, job_id), ignore_errors=True)
+
+    # ---------- 게시 / 조회 ----------
+    def publish(self, src_path, job_id=None, name=None):
+        # 같은 파일시스템 안의 os.replace → 원자적 교체
+        filename = name or os.path.basename(src_path)
+        sha256 = file_sha256(src_path)
+        name = content_name(filename, sha256)
+        dst = self.shard_path(name)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        size = os.path.getsize(src_path)
+        os.replace(src_path, dst)
+        now = time.time()
+        os.utime(dst, (now, now))
+        with self._lock:
+            old = self._index.get(name)
+            if old:
+                self._total -= old["size"]
+            self._index[name] = {"size": size, "created": now, "atime": now, "job": job_id,
+                                 "sha256": sha256, "filename": filename}
+            self._total += size
+            self._dirty = True
+        return name
+
+    def resolve(self, name):
+        # 다운로드 경로 조회 + 접근 시각 갱신 (인덱스에 있으면 파일시스템 조회 없음)
+        # 접근 시각은 메모리에만 기록하고 정리 주기에 flush_atimes 가 디스크에 반영
+        with self._lock:
+            meta = self._index.get(name)
+            if meta is not None:
+                meta["atime"] = time.time()
+                self._touched.add(name)
+                self._dirty = True
+                return dict(meta, name=name, path=self.shard_path(name), etag=self._etag(name, meta))
+        return self._adopt(name)
+
+    @staticmethod
+    def _etag(name, meta):
+        # 게시 이름에 들어 있는 내용 해시 → 어느 워커가 응답해도 같은 ETag
+        return split_content_name(name)[1] or meta["sha256"]
+
+    def _adopt(self, name):
+        # 다중 워커(gunicorn)에서는 워커마다 인덱스가 따로 있음
+        # → 다른 워커가 게시한 파일이면 디스크에서 찾아 이 워커의 인덱스에 추가
+        # 내용 해시는 게시 이름에서 얻음 (파일 전체를 다시 읽지 않음)
+        path = self.shard_path(name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        filename, digest = split_content_name(name)
+        sha256 = digest or file_sha256(path)  # 해시가 없는 예전 이름만 직접 계산
+        meta = {"size": st.st_size, "created": st.st_mtime, "atime": time.time(), "job": None,
+                "sha256": sha256, "filename": filename}
+        with self._lock:
+            if name not in self._index:
+                self._index[name] = meta
+                self._total += meta["size"]
+            self._touched.add(name)
+            self._dirty = True
+            meta = self._index[name]
+            return dict(meta, name=name, path=path, etag=self._etag(name, meta))
+
+    def flush_atimes(self):
+        # 메모리의 마지막 접근 시각을 파일 atime 으로 기록 (mtime 은 게시 시각 그대로)
+        # → 정리 담당 프로세스가 디스크를 훑을 때 이 워커의 접근을 반영
+        with self._lock:
+            touched, self._touched = self._touched, set()
+            times = {n: (self._index[n]["atime"], self._index[n]["created"])
+                     for n in touched if n in self._index}
+        for name, (atime, mtime) in times.items():
+            try:
+                os.utime(self.shard_path(name), (atime, mtime))
+            except FileNotFoundError:
+                self.remove(name)  # 다른 워커(정리 담당)가 이미 삭제한 파일
+
+    def remove(self, name, unless_accessed_after=None):
+        # unless_accessed_after: 정리 대상으로 고른 뒤 다른 워커가 접근한 파일은 남김
+        if unless_accessed_after is not None:
+            try:
+                if os.stat(self.shard_path(name)).st_atime > unless_accessed_after:
+                    return False
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            meta = self._index.pop(name, None)
+            if meta is None:
+                return False
+            self._total -= meta["size"]
+            self._dirty = True
+        try:
+            os.remove(self.shard_path(name))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._index), "bytes": self._total,
+                    "max_bytes": self.max_bytes, "ttl": self.ttl}
+
+    # ---------- 정리(eviction) ----------
+    def evict(self, now=None):
+        # 정리 담당 프로세스에서만 호출: 디스크를 다시 훑어 다른 워커가 게시/접근한 파일까지 반영한 뒤
+        # 전체 용량 / TTL 기준으로 삭제 대상 선정
+        now = now or time.time()
+        with self._lock:
+            known = dict(self._index)
+        index = self._scan(known=known)
+        with self._lock:
+            self._index = index
+            self._total = sum(m["size"] for m in index.values())
+            self._dirty = True
+            expired = [n for n, m in self._index.items() if now - m["atime"] > self.ttl]
+            over = self._total - sum(self._index[n]["size"] for n in expired) - self.max_bytes
+            if over > 0:
+                gone = set(expired)
+                alive = sorted((m["atime"], n) for n, m in self._index.items() if n not in gone)
+                for _, n in alive:
+                    if over <= 0:
+                        break
+                    expired.append(n)
+                    over -= self._index[n]["size"]
+            chosen = [(n, self._index[n]["atime"]) for n in expired]
+        expired = [n for n, atime in chosen if self.remove(n, unless_accessed_after=atime)]
+        self._sweep_staging(now)
+        if expired:
+            print(f"[🧹] Evicted {len(expired)} result files ({self.stats()['bytes'] / 1024 ** 2:.1f} MB kept)")
+        return expired
+
+    def _sweep_staging(self, now):
+        # 비정상 종료로 남은 작업 폴더 정리
+        staging = os.path.join(self.root, STAGING_DIR)
+        for entry in os.scandir(staging):
+            try:
+                if now - entry.stat().st_mtime > self.ttl:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except FileNotFoundError:
+                pass
+
+    def _acquire_evictor(self):
+        # 비차단 flock: 잡은 프로세스가 종료되면 커널이 풀어 주므로 다른 워커가 이어받음
+        if self._evictor_lock is not None:
+            return True
+        if fcntl is None:
+            self._evictor_lock = True
+            return True
+        f = open(os.path.join(self.root, EVICTOR_LOCK), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._evictor_lock = f
+        print(f"[🧹] Worker {os.getpid()} runs result store eviction")
+        return True
+
+    def _release_evictor(self):
+        lock, self._evictor_lock = self._evictor_lock, None
+        if lock not in (None, True):
+            lock.close()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="result-store-evictor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush_atimes()
+        if self._evictor_lock is not None:
+            self.save()
+        self._release_evictor()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush_atimes()
+                if not self._acquire_evictor():
+                    continue
+                self.evict()
+                self.save()
+            except Exception as e:
+                print(f"[❌] Result store maintenance failed: {e}")
+
+    # ---------- 인덱스 영속화 ----------
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._index)
+            self._dirty = False
+        path = os.path.join(self.root, INDEX_FILE)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _load(self):
+        path = os.path.join(self.root, INDEX_FILE)
+        index = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    index = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                index = {}
+        # 실제 샤드 폴더 기준으로 재구성: 인덱스 저장 전에 게시된 파일은 추가,
+        # 인덱스에는 있지만 실제로 없는 파일은 제거
+        self._index = self._scan(known=index)
+        self._total = sum(m["size"] for m in self._index.values())
+        self._dirty = True
+
+    def _scan(self, known=None):
+        index = {}
+        known = known or {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if STAGING_DIR in dirnames:
+                dirnames.remove(STAGING_DIR)
+            if os.path.relpath(dirpath, self.root).count(os.sep) != 1:
+                continue
+            for fname in filenames:
+                path = os.path.join(dirpath, fname)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if fname in known and "sha256" in known[fname]:
+                    # 마지막 접근 시각은 메모리 값과 디스크 atime(다른 워커의 resolve) 중 최신
+                    index[fname] = dict(known[fname], atime=max(known[fname]["atime"], st.st_atime))
+                    continue
+                sha256 = file_sha256(path)
+                # 해시 계산을 위한 읽기가 atime 을 갱신하지 않도록 원래 시각으로 되돌림
+                os.utime(path, (st.st_atime, st.st_mtime))
+                index[fname] = {"size": st.st_size, "created": st.st_mtime,
+                                "atime": max(st.st_mtime, st.st_atime), "job": None,
+                                "sha256": sha256, "filename": fname}
+        return index
@@ -0,0 +1,171 @@
+import os
+import argparse
+import cv2
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# ------------------------
+# 단일 패스 기호 후보 추출
+# ------------------------
+# note_substract.py / note_substract2.py / rest_substract.py / remove_lines.py / specific_substract.py 의
+# 필터 규칙을 한 곳에 모은 버전.
+# 이미지당 디코딩·오선 제거는 한 번, 연결 요소 통계는 팽창 커널별로 한 번만 계산하고
+# 모든 규칙을 그 통계 표에 NumPy 로 한꺼번에 적용한다.
+INPUT_DIR = "images"
+CROP_SIZE = 64
+
+# 팽창 방식: (커널 모양, 크기, 반복 횟수)
+RECT3_X2 = (cv2.MORPH_RECT, 3, 2)
+RECT3_X1 = (cv2.MORPH_RECT, 3, 1)
+ELLIPSE2_X1 = (cv2.MORPH_ELLIPSE, 2, 1)
+ELLIPSE3_X1 = (cv2.MORPH_ELLIPSE, 3, 1)
+
+# 카테고리: 출력 폴더, 팽창 방식, (w, h, extent, aspect_ratio) 범위, 정사각 padding 여부
+RULES = {
+    # note_substract.py
+    'note': {'dir': 'note_symbols_improved', 'dilate': RECT3_X2, 'w': (10, 80), 'h': (20, 120),
+             'extent': (0.2, 0.95), 'aspect': (0.1, 1.2), 'pad': True},
+    # note_substract2.py
+    'note_wide': {'dir': 'extracted_notes_from_folder', 'dilate': RECT3_X2, 'w': (10, 90), 'h': (20, 120),
+                  'extent': (0.25, 0.95), 'aspect': (0.1, 1.4), 'pad': True},
+    # rest_substract.py
+    'rest': {'dir': 'rest_symbol_crops', 'dilate': ELLIPSE2_X1, 'w': (8, 40), 'h': (10, 45),
+             'extent': (None, 0.45), 'aspect': (None, None), 'pad': False},
+    # specific_substract.extract_symbols_from_image
+    'symbol': {'dir': 'special_symbol_candidates', 'dilate': ELLIPSE3_X1, 'w': (10, 60), 'h': (10, 60),
+               'extent': (0.3, 0.95), 'aspect': (0.5, 2.5), 'pad': True},
+    # specific_substract.extract_rest_candidates (온쉼표/이분쉼표: 가로로 긴 꽉 찬 블럭)
+    'block_rest': {'dir': 'special_symbol_candidates', 'dilate': RECT3_X1, 'w': (8, 40), 'h': (4, 20),
+                   'extent': (0.6, 1.0), 'aspect': (1.2, 3.5), 'pad': True, 'extent_inclusive': True},
+}
+CLEANED_DIR = 'removed_staff_lines'  # remove_lines.py
+
+
+def remove_staff_lines(gray):
+    # 적응형 이진화 → 긴 수평선(폭 > 70%, 높이 < 4) 제거, 흰 배경 + 검은 기호 반환
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                   cv2.THRESH_BINARY_INV, 15, 10)
+    horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (60, 1))
+    staff_lines = cv2.morphologyEx(binary, cv2.MORPH_OPEN, horizontal_kernel, iterations=1)
+
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(staff_lines, connectivity=8)
+    is_staff = (stats[:, cv2.CC_STAT_WIDTH] > 0.7 * binary.shape[1]) & (stats[:, cv2.CC_STAT_HEIGHT] < 4)
+    is_staff[0] = False
+    staff_mask = np.where(is_staff[labels], 255, 0).astype(np.uint8)
+
+    no_staff = cv2.subtract(binary, staff_mask)
+    return cv2.bitwise_not(no_staff)
+
+def fill_holes(binary):
+    padded = cv2.copyMakeBorder(binary, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    mask = np.zeros((padded.shape[0] + 2, padded.shape[1] + 2), np.uint8)
+    cv2.floodFill(padded, mask, (0, 0), 255)
+    holes = cv2.bitwise_not(padded)[1:-1, 1:-1]
+    return cv2.bitwise_or(binary, holes)
+
+def component_stats(ink, dilate):
+    # 외곽 컨투어 기준 통계: 구멍을 채운 뒤 연결 요소 분석
+    # cv2.contourArea 는 경계 픽셀 중심을 잇는 다각형 면적이므로 Pick 정리로 환산:
+    #   다각형 면적 = 픽셀 수 - 경계 픽셀 수 / 2 - 1
+    shape, size, iterations = dilate
+    kernel = cv2.getStructuringElement(shape, (size, size))
+    dilated = cv2.dilate(ink, kernel, iterations=iterations)
+    filled = fill_holes(dilated)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(filled, connectivity=8)
+    cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    boundary = cv2.subtract(filled, cv2.erode(filled, cross, borderType=cv2.BORDER_CONSTANT, borderValue=0))
+    boundary_count = np.bincount(labels[boundary > 0], minlength=n)[1:]
+
+    stats = stats[1:]
+    x, y = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+    w, h = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]
+    area = np.maximum(stats[:, cv2.CC_STAT_AREA] - boundary_count / 2.0 - 1, 0)
+    rect_area = (w * h).astype(np.float64)
+    extent = np.divide(area, rect_area, out=np.zeros_like(area), where=rect_area > 0)
+    aspect = np.divide(w, h, out=np.zeros_like(area), where=h > 0)
+    return {'x': x, 'y': y, 'w': w, 'h': h, 'extent': extent, 'aspect': aspect}
+
+def _between(values, bounds, inclusive_high=False):
+    lo, hi = bounds
+    ok = np.ones(values.shape, dtype=bool)
+    if lo is not None:
+        ok &= values > lo
+    if hi is not None:
+        ok &= (values <= hi) if inclusive_high else (values < hi)
+    return ok
+
+def select(stats, rule):
+    ok = _between(stats['w'], rule['w']) & _between(stats['h'], rule['h'])
+    ok &= _between(stats['extent'], rule['extent'], rule.get('extent_inclusive', False))
+    ok &= _between(stats['aspect'], rule['aspect'])
+    return np.flatnonzero(ok)
+
+def to_crop(cleaned, x, y, w, h, pad, size=CROP_SIZE):
+    crop = cleaned[y:y+h, x:x+w]
+    if pad:
+        # 비율 유지하며 padding → 정사각형
+        max_side = max(crop.shape)
+        padded = np.full((max_side, max_side), 255, dtype=np.uint8)
+        y_offset = (max_side - crop.shape[0]) // 2
+        x_offset = (max_side - crop.shape[1]) // 2
+        padded[y_offset:y_offset+crop.shape[0], x_offset:x_offset+crop.shape[1]] = crop
+        crop = padded
+    return cv2.resize(crop, (size, size))
+
+def extract_from_image(image_path, output_root='.', categories=None, save_cleaned=False):
+    gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        print(f"이미지 로드 실패: {image_path}")
+        return image_path, {}
+
+    categories = categories or list(RULES)
+    prefix = Path(image_path).stem
+    cleaned = remove_staff_lines(gray)
+    if save_cleaned:
+        os.makedirs(os.path.join(output_root, CLEANED_DIR), exist_ok=True)
+        cv2.imwrite(os.path.join(output_root, CLEANED_DIR, os.path.basename(image_path)), cleaned)
+
+    _, ink = cv2.threshold(cleaned, 127, 255, cv2.THRESH_BINARY_INV)
+    stats_cache = {}
+    counts = {}
+    for name in categories:
+        rule = RULES[name]
+        if rule['dilate'] not in stats_cache:
+            stats_cache[rule['dilate']] = component_stats(ink, rule['dilate'])
+        stats = stats_cache[rule['dilate']]
+
+        out_dir = os.path.join(output_root, rule['dir'])
+        os.makedirs(out_dir, exist_ok=True)
+        picked = select(stats, rule)
+        for count, i in enumerate(picked):
+            crop = to_crop(cleaned, stats['x'][i], stats['y'][i], stats['w'][i], stats['h'][i], rule['pad'])
+            cv2.imwrite(os.path.join(out_dir, f"{prefix}_{name}_{count:03}.png"), crop)
+        counts[name] = len(picked)
+    return image_path, counts
+
+def extract_all(input_dir=INPUT_DIR, output_root='.', categories=None, save_cleaned=False, workers=None):
+    paths = [os.path.join(input_dir, f) for f in sorted(os.listdir(input_dir)) if f.lower().endswith('.png')]
+    totals = {name: 0 for name in (categories or RULES)}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = [pool.submit(extract_from_image, p, output_root, categories, save_cleaned) for p in paths]
+        for future in as_completed(futures):
+            path, counts = future.result()
+            print(f"{os.path.basename(path)}: " + ", ".join(f"{k} {v}개" for k, v in counts.items()))
+            for name, count in counts.items():
+                totals[name] += count
+
+    print(f"\n🎉 오선 제거 후 총 추출된 후보 수: " + ", ".join(f"{k} {v}개" for k, v in totals.items()))
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="음표/쉼표/특수 기호 후보 일괄 추출")
+    parser.add_argument("--input", default=INPUT_DIR)
+    parser.add_argument("--output", default=".", help="카테고리별 출력 폴더의 상위 경로")
+    parser.add_argument("--categories", nargs="+", choices=list(RULES), default=None)
+    parser.add_argument("--save-cleaned", action="store_true", help=f"오선 제거 이미지도 {CLEANED_DIR}/ 에 저장")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    extract_all(args.input, args.output, args.categories, args.save_cleaned, args.workers)
@@ -1,38 +1,22 @@
+import os
+import json
+import hashlib
+import argparse
+import cv2
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torchvision import datasets, transforms
-from torch.utils.data import DataLoader
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
-import os
-from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
+from torch.utils.data import DataLoader, Dataset
 
 # 하이퍼파라미터
 BATCH_SIZE = 32
 EPOCHS = 100
 IMG_SIZE = 64
 DATA_DIR = 'note_dataset/'
-
-# 전처리 정의 (플립 포함)
-transform = transforms.Compose([
-    transforms.Grayscale(),
-    transforms.Resize((IMG_SIZE, IMG_SIZE)),
-    transforms.RandomHorizontalFlip(p=0.5),
-    transforms.RandomVerticalFlip(p=0.5),
-    transforms.ToTensor(),
-    transforms.Normalize((0.5,), (0.5,))
-])
-
-# 데이터셋 로딩
-full_dataset = datasets.ImageFolder(root=DATA_DIR, transform=transform)
-class_names = full_dataset.classes
-train_size = int(0.8 * len(full_dataset))
-val_size = len(full_dataset) - train_size
-train_dataset, val_dataset = torch.utils.data.random_split(full_dataset, [train_size, val_size])
-train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
-val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE, shuffle=False)
+CACHE_DIR = 'note_dataset_cache/'
+NUM_WORKERS = 2
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp')
 
 # 모델 정의
 class NoteCNN(nn.Module):
@@ -58,67 +42,184 @@ class NoteCNN(nn.Module):
         x = self.classifier(x)
         return x
 
-# 학습 준비
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = NoteCNN(num_classes=len(class_names)).to(device)
-criterion = nn.CrossEntropyLoss()
-optimizer = optim.Adam(model.parameters(), lr=0.001)
-
-best_val_acc = 0.0
-best_model_path = 'note_classifier_best.pth'
-
-# 학습 루프
-for epoch in range(EPOCHS):
-    model.train()
-    train_loss = 0
-    correct = 0
-    total = 0
-    for images, labels in train_loader:
-        images, labels = images.to(device), labels.to(device)
-        optimizer.zero_grad()
-        outputs = model(images)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
-        train_loss += loss.item()
-        _, predicted = torch.max(outputs, 1)
-        correct += (predicted == labels).sum().item()
-        total += labels.size(0)
-    acc = 100 * correct / total
-    print(f"Epoch {epoch+1}/{EPOCHS} - Loss: {train_loss:.4f} - Accuracy: {acc:.2f}%")
-
-    # 검증 및 베스트 모델 저장
+# ------------------------
+# 1회성 전처리: PNG → memmap uint8 배열
+# ------------------------
+# ImageFolder 와 같은 규칙: DATA_DIR/<클래스>/<이미지>, 클래스는 폴더명 정렬 순
+# 결과: CACHE_DIR/images.npy (N, 64, 64) uint8, labels.npy (N,) int64, classes.json
+def scan_image_folder(data_dir):
+    classes = sorted(d.name for d in os.scandir(data_dir) if d.is_dir())
+    samples = []
+    for label, cls in enumerate(classes):
+        cls_dir = os.path.join(data_dir, cls)
+        for root, _, files in sorted(os.walk(cls_dir)):
+            for fname in sorted(files):
+                if fname.lower().endswith(IMAGE_EXTS):
+                    samples.append((os.path.join(root, fname), label))
+    return classes, samples
+
+def preprocess_gray(gray, img_size=IMG_SIZE):
+    return cv2.resize(gray, (img_size, img_size), interpolation=cv2.INTER_AREA)
+
+def samples_hash(samples):
+    # 경로·라벨·크기·수정 시각 → 개수가 같아도 파일 교체/클래스 이동이 있으면 캐시 재생성
+    digest = hashlib.sha1()
+    for path, label in samples:
+        st = os.stat(path)
+        digest.update(f"{path}\0{label}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def preprocess_to_memmap(data_dir=DATA_DIR, cache_dir=CACHE_DIR, img_size=IMG_SIZE, force=False):
+    classes, samples = scan_image_folder(data_dir)
+    meta_path = os.path.join(cache_dir, 'classes.json')
+    meta = {'classes': classes, 'count': len(samples), 'img_size': img_size,
+            'samples_hash': samples_hash(samples)}
+    if not force and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                print(f"[INFO] Using cached dataset: {cache_dir} ({len(samples)} images)")
+                return meta
+
+    os.makedirs(cache_dir, exist_ok=True)
+    images = np.lib.format.open_memmap(os.path.join(cache_dir, 'images.npy'), mode='w+',
+                                       dtype=np.uint8, shape=(len(samples), img_size, img_size))
+    labels = np.empty(len(samples), dtype=np.int64)
+    for i, (path, label) in enumerate(samples):
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError(f"Could not decode image: {path}")
+        images[i] = preprocess_gray(gray, img_size)
+        labels[i] = label
+    images.flush()
+    del images
+    np.save(os.path.join(cache_dir, 'labels.npy'), labels)
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    print(f"[INFO] Cached {len(samples)} images → {cache_dir}")
+    return meta
+
+class MemmapNoteDataset(Dataset):
+    # 전처리된 uint8 배열을 memmap 으로 읽기 (디코딩/리사이즈 없음)
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.images = np.load(os.path.join(cache_dir, 'images.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(cache_dir, 'labels.npy'))
+        with open(os.path.join(cache_dir, 'classes.json')) as f:
+            self.classes = json.load(f)['classes']
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        return torch.from_numpy(np.array(self.images[i])), int(self.labels[i])
+
+# ------------------------
+# 배치 단위 텐서 연산 (정규화 + 플립 증강)
+# ------------------------
+def normalize_batch(images):
+    # uint8 (B, H, W) → float (B, 1, H, W), Normalize((0.5,), (0.5,)) 와 동일
+    return (images.float().unsqueeze(1) / 255.0 - 0.5) / 0.5
+
+def augment_batch(x, p=0.5):
+    # 샘플별 RandomHorizontalFlip / RandomVerticalFlip 을 배치 전체에 한 번에 적용
+    b = x.shape[0]
+    hflip = torch.rand(b, 1, 1, 1, device=x.device) < p
+    x = torch.where(hflip, x.flip(3), x)
+    vflip = torch.rand(b, 1, 1, 1, device=x.device) < p
+    return torch.where(vflip, x.flip(2), x)
+
+def build_loaders(cache_dir=CACHE_DIR, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, seed=0):
+    full_dataset = MemmapNoteDataset(cache_dir)
+    train_size = int(0.8 * len(full_dataset))
+    val_size = len(full_dataset) - train_size
+    generator = torch.Generator().manual_seed(seed)
+    train_dataset, val_dataset = torch.utils.data.random_split(full_dataset, [train_size, val_size],
+                                                               generator=generator)
+    loader_args = {
+        'batch_size': batch_size,
+        'num_workers': num_workers,
+        'pin_memory': torch.cuda.is_available(),
+        'persistent_workers': num_workers > 0,
+    }
+    train_loader = DataLoader(train_dataset, shuffle=True, **loader_args)
+    val_loader = DataLoader(val_dataset, shuffle=False, **loader_args)
+    return train_loader, val_loader, full_dataset.classes
+
+# ------------------------
+# 학습
+# ------------------------
+def evaluate(model, dataloader, device):
     model.eval()
-    val_correct = 0
-    val_total = 0
+    correct, total = 0, 0
     with torch.no_grad():
-        for val_images, val_labels in val_loader:
-            val_images, val_labels = val_images.to(device), val_labels.to(device)
-            val_outputs = model(val_images)
-            _, val_preds = torch.max(val_outputs, 1)
-            val_correct += (val_preds == val_labels).sum().item()
-            val_total += val_labels.size(0)
-    val_acc = 100 * val_correct / val_total
-    print(f"Validation Accuracy: {val_acc:.2f}%")
-    if val_acc > best_val_acc:
-        best_val_acc = val_acc
-        torch.save(model.state_dict(), best_model_path)
-        print("\t✅ Best model updated.")
-
-# 최종 모델 저장
-torch.save(model.state_dict(), 'note_classifier_cnn.pth')
-print("\n최종 모델 저장 완료: note_classifier_cnn.pth")
-print("베스트 모델 저장 위치: note_classifier_best.pth")
-print("클래스 목록:", class_names)
+        for images, labels in dataloader:
+            images = normalize_batch(images.to(device, non_blocking=True))
+            labels = labels.to(device, non_blocking=True)
+            _, preds = torch.max(model(images), 1)
+            correct += (preds == labels).sum().item()
+            total += labels.size(0)
+    return 100 * correct / max(total, 1)
+
+def train(data_dir=DATA_DIR, cache_dir=CACHE_DIR, epochs=EPOCHS, batch_size=BATCH_SIZE,
+          num_workers=NUM_WORKERS, best_model_path='note_classifier_best.pth',
+          final_model_path='note_classifier_cnn.pth'):
+    preprocess_to_memmap(data_dir, cache_dir)
+    train_loader, val_loader, class_names = build_loaders(cache_dir, batch_size, num_workers)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = NoteCNN(num_classes=len(class_names)).to(device)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=0.001)
+    best_val_acc = 0.0
+
+    for epoch in range(epochs):
+        model.train()
+        train_loss = 0
+        correct = 0
+        total = 0
+        for images, labels in train_loader:
+            images = augment_batch(normalize_batch(images.to(device, non_blocking=True)))
+            labels = labels.to(device, non_blocking=True)
+            optimizer.zero_grad()
+            outputs = model(images)
+            loss = criterion(outputs, labels)
+            loss.backward()
+            optimizer.step()
+            train_loss += loss.item()
+            _, predicted = torch.max(outputs, 1)
+            correct += (predicted == labels).sum().item()
+            total += labels.size(0)
+        acc = 100 * correct / total
+        print(f"Epoch {epoch+1}/{epochs} - Loss: {train_loss:.4f} - Accuracy: {acc:.2f}%")
+
+        # 검증 및 베스트 모델 저장
+        val_acc = evaluate(model, val_loader, device)
+        print(f"Validation Accuracy: {val_acc:.2f}%")
+        if val_acc > best_val_acc:
+            best_val_acc = val_acc
+            torch.save(model.state_dict(), best_model_path)
+            print("\t✅ Best model updated.")
+
+    # 최종 모델 저장
+    torch.save(model.state_dict(), final_model_path)
+    print(f"\n최종 모델 저장 완료: {final_model_path}")
+    print(f"베스트 모델 저장 위치: {best_model_path}")
+    print("클래스 목록:", class_names)
+
+    model.load_state_dict(torch.load(best_model_path, map_location=device))
+    return model, val_loader, class_names
 
 # confusion matrix 시각화 (검증 세트 기준)
 def plot_confusion_matrix(model, dataloader, classes):
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
+
+    device = next(model.parameters()).device
     model.eval()
     all_preds = []
     all_labels = []
     with torch.no_grad():
         for images, labels in dataloader:
-            images = images.to(device)
+            images = normalize_batch(images.to(device))
             outputs = model(images)
             _, preds = torch.max(outputs, 1)
             all_preds.extend(preds.cpu().numpy())
@@ -131,17 +232,29 @@ def plot_confusion_matrix(model, dataloader, classes):
     plt.tight_layout()
     plt.show()
 
-# 베스트 모델로 confusion matrix 출력
-model.load_state_dict(torch.load(best_model_path))
-plot_confusion_matrix(model, val_loader, class_names)
-
 # 단일 이미지 예측 함수
-def predict_image(image_path):
-    from PIL import Image
+def predict_image(model, image_path, class_names):
+    device = next(model.parameters()).device
+    gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    image = normalize_batch(torch.from_numpy(preprocess_gray(gray))[None].to(device))
     model.eval()
-    image = Image.open(image_path).convert('L')
-    image = transform(image).unsqueeze(0).to(device)
     with torch.no_grad():
         output = model(image)
         _, pred = torch.max(output, 1)
     return class_names[pred.item()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NoteCNN 학습")
+    parser.add_argument("--data", default=DATA_DIR)
+    parser.add_argument("--cache", default=CACHE_DIR)
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="DataLoader 워커 수")
+    parser.add_argument("--no-plot", action="store_true")
+    args = parser.parse_args()
+
+    model, val_loader, class_names = train(args.data, args.cache, args.epochs, args.batch_size, args.workers)
+    if not args.no_plot:
+        # 베스트 모델로 confusion matrix 출력
+        plot_confusion_matrix(model, val_loader, class_names)
@@ -4,13 +4,19 @@ import numpy as np
 from ultralytics import YOLO
 
 # 1. 오선 제거
-def remove_staff_lines(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def remove_staff_lines_gray(gray, page_width=None):
+    # 커널이 가로 방향(높이 1)뿐이라 행 단위로 독립적 → 띠(band) 단위로 나눠 돌려도 결과 동일
+    page_width = page_width or gray.shape[1]
     _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
-    horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (image.shape[1] // 15, 1))
+    horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (page_width // 15, 1))
     detected_lines = cv2.morphologyEx(binary, cv2.MORPH_OPEN, horizontal_kernel, iterations=1)
     no_staff = cv2.bitwise_and(binary, binary, mask=cv2.bitwise_not(detected_lines))
-    no_staff = cv2.bitwise_not(no_staff)
+    return cv2.bitwise_not(no_staff), detected_lines
+
+def remove_staff_lines(image):
+    # 1채널(이진화된 업로드) 입력은 흑백 변환 생략
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    no_staff, _ = remove_staff_lines_gray(gray)
     return cv2.cvtColor(no_staff, cv2.COLOR_GRAY2BGR)
 
 # 2. 이미지 분할 및 위치 저장
@@ -29,8 +35,15 @@ def split_image_with_offsets(image, patch_size=(640, 640), stride=(480, 480)):
     return patches, positions
 
 # 3. YOLO 추론 실행
-def run_yolo_on_patches(model, patches, conf=0.25):
+def run_yolo_on_patches(model, patches, conf=0.25, batch_size=1):
+    # batch_size > 1: 타일 목록을 한 번의 predict 로 배치 추론 (결과는 입력 순서대로)
+    # ONNX/OpenVINO 변환 모델은 batch 1 고정(dynamic=False)이므로 1 유지
     results_all = []
+    if batch_size > 1:
+        for start in range(0, len(patches), batch_size):
+            results_all.extend(model.predict(source=list(patches[start:start + batch_size]),
+                                             conf=conf, verbose=False))
+        return results_all
     for patch in patches:
         result = model.predict(source=patch, conf=conf, verbose=False)
         results_all.append(result[0])  # 1개 이미지라 [0]
@@ -79,13 +92,16 @@ def apply_nms(boxes, iou_thresh=0.5):
     return final
 
 # 6. 시각화
-def draw_final_boxes(image, boxes, class_names):
+def draw_final_boxes(image, boxes, class_names, crop_dir="cropped_notes"):
+    # crop_dir=None 이면 음표 crop 저장 생략 (배치/서버 처리용)
+    if crop_dir:
+        os.makedirs(crop_dir, exist_ok=True)
     for i, box in enumerate(boxes):
         x1, y1, x2, y2 = box['x1'], box['y1'], box['x2'], box['y2']
-        crop = image[y1:y2, x1:x2]
-        os.makedirs("cropped_notes", exist_ok=True)
-        save_path = os.path.join("cropped_notes", f"note_{i+1}.png")
-        cv2.imwrite(save_path, crop)
+        if crop_dir:
+            crop = image[y1:y2, x1:x2]
+            save_path = os.path.join(crop_dir, f"note_{i+1}.png")
+            cv2.imwrite(save_path, crop)
         cls = box['cls']
         conf = box['conf']
         label = f"{class_names[cls]} {conf:.2f}"
@@ -0,0 +1,85 @@
+import io
+import cv2
+import numpy as np
+
+# ------------------------
+# 다중 페이지 문서(PDF/TIFF) 읽기
+# ------------------------
+PDF_DPI = 300
+
+def is_pdf(data):
+    return data[:5] == b"%PDF-"
+
+def is_tiff(data):
+    return data[:4] in (b"II*\x00", b"MM\x00*")
+
+def is_multipage(data):
+    return is_pdf(data) or is_tiff(data)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def is_prebinarized(data):
+    # 프론트엔드(Web Worker)에서 축소·이진화한 1-bit 흑백 PNG인지 IHDR만 보고 판단
+    # IHDR: signature(8) + length(4) + "IHDR"(4) + width(4) + height(4) + bit depth(1) + color type(1)
+    return (len(data) >= 26 and data[:8] == PNG_SIGNATURE and data[12:16] == b"IHDR"
+            and data[24] == 1 and data[25] == 0)
+
+def decode_image(data, grayscale=False):
+    # 임시 파일 없이 메모리에서 바로 디코딩
+    # grayscale=True: 이진화된 입력은 1채널로 디코딩 (BGR 변환/메모리 3배 생략)
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
+
+def image_pixels(data):
+    # 헤더만 읽어 크기 확인 (디코딩 없음)
+    from PIL import Image
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            return im.width * im.height
+    except Image.DecompressionBombError:
+        return float("inf")  # PIL 한도를 넘는 초대형 이미지
+    except Exception:
+        return 0
+
+def _open_pdf(data):
+    try:
+        import fitz  # PyMuPDF
+    except ImportError:
+        raise RuntimeError("PDF input requires PyMuPDF (pip install pymupdf)")
+    return fitz.open(stream=data, filetype="pdf")
+
+def page_count(data):
+    if is_pdf(data):
+        with _open_pdf(data) as doc:
+            return doc.page_count
+    if is_tiff(data):
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as im:
+            return getattr(im, "n_frames", 1)
+    return 1
+
+def iter_pages(data, dpi=PDF_DPI):
+    # 페이지를 하나씩 필요할 때 래스터화 → 메모리에는 항상 한 페이지만 존재
+    if is_pdf(data):
+        with _open_pdf(data) as doc:
+            for index, page in enumerate(doc):
+                pix = page.get_pixmap(dpi=dpi, alpha=False)
+                rgb = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, pix.n)
+                if pix.n == 1:
+                    image = cv2.cvtColor(rgb, cv2.COLOR_GRAY2BGR)
+                else:
+                    image = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+                del pix, rgb
+                yield index, image
+    elif is_tiff(data):
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as im:
+            for index in range(getattr(im, "n_frames", 1)):
+                im.seek(index)
+                rgb = np.asarray(im.convert("RGB"))
+                yield index, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    else:
+        yield 0, decode_image(data)
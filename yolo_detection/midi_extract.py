@@ -1,7 +1,11 @@
+import json
 import cv2
 import numpy as np
 import pretty_midi
-from ultralytics import YOLO
+from yolo_detection.onnx_backend import load_detector, HEAD_MODEL_PATH
+from yolo_detection.data_preprocess import remove_staff_lines
+from collections import Counter
+from yolo_detection.note_gate import get_note_gate, gate_boxes, gate_source_page
 
 # ------------------------
 # 상수 정의
@@ -22,6 +26,11 @@ NOTE_DURATION = {
 
 REST_CLASSES = {'whole_rest', 'half_rest', 'quarter_rest', 'eighth_rest'}
 
+# NOTE_DURATION(초)의 기준 템포 (4분음표 0.5초 = 120 BPM), 렌더링 기본값
+DEFAULT_TEMPO = 120.0
+DEFAULT_PROGRAM = 0     # Acoustic Grand Piano
+DEFAULT_VELOCITY = 100
+
 G_CLEF_PITCHES = [
     'A5', 'G5', 'F5', 'E5', 'D5', 'C5', 'B4', 'A4',
     'G4', 'F4', 'E4', 'D4', 'C4', 'B3', 'A3'
@@ -32,11 +41,14 @@ F_CLEF_PITCHES = [
     'B2', 'A2', 'G2', 'F2', 'E2', 'D2', 'C2'
 ]
 
+# 형태학 기반 head 탐지의 신뢰도가 이 값 미만이면 head 모델로 fallback
+HEAD_FAST_CONF = 0.6
+
 # ------------------------
 # 오선 검출 및 군집화
 # ------------------------
 def detect_staff_lines_from_removal(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (image.shape[1] // 15, 1))
     lines = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel, iterations=1)
@@ -65,16 +77,29 @@ def is_upper_staff(staff_block, image_height):
 # ------------------------
 # note head 추정
 # ------------------------
-def find_note_head_within_box(image, box, head_model):
+_head_model = None
+
+def get_head_model(backend=None):
+    # head 모델은 프로세스당 한 번만 로드 (MUSESCAN_BACKEND 에 따라 torch/onnx/openvino)
+    global _head_model
+    if _head_model is None:
+        _head_model = load_detector(HEAD_MODEL_PATH, backend)
+    return _head_model
+
+def find_note_head_within_box(image, box, head_model, debug=False):
+    # debug=True 일 때만 실패한 crop 을 작업 폴더에 저장 (서버에서는 MUSESCAN_DEBUG=1)
     x1, y1, x2, y2 = box['x1'], box['y1'], box['x2'], box['y2']
     x1, y1 = max(0, x1), max(0, y1)
     x2, y2 = min(image.shape[1], x2), min(image.shape[0], y2)
     crop = image[y1:y2, x1:x2]
+    if crop.ndim == 2:
+        crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR)
 
     result = head_model.predict(source=crop, conf=0.01, verbose=False)[0]
     if not result.boxes or len(result.boxes) == 0:
         print(f"[⚠️ Head 예측 실패] box: ({x1},{y1},{x2},{y2})")
-        cv2.imwrite(f'debug_failed_crop_{x1}_{y1}.png', crop)
+        if debug:
+            cv2.imwrite(f'debug_failed_crop_{x1}_{y1}.png', crop)
         return None
 
     head_box = result.boxes[0]
@@ -88,6 +113,94 @@ def find_note_head_within_box(image, box, head_model):
 
     return y_center + y1  # 원본 이미지 기준
 
+def fill_holes(binary):
+    # 테두리에서 닿지 않는 배경 = 빈 머리(2분/온음표) 내부 → 채워서 꽉 찬 blob으로
+    padded = cv2.copyMakeBorder(binary, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    flooded = padded.copy()
+    mask = np.zeros((padded.shape[0] + 2, padded.shape[1] + 2), np.uint8)
+    cv2.floodFill(flooded, mask, (0, 0), 255)
+    holes = cv2.bitwise_not(flooded)[1:-1, 1:-1]
+    return cv2.bitwise_or(binary, holes)
+
+def find_note_head_classical(cleaned_crop, spacing):
+    # 오선 제거된 crop에서 연결 요소 분석으로 head 중심 y 탐색
+    # 반환: (crop 기준 y 또는 None, 신뢰도 0~1)
+    if spacing <= 0 or cleaned_crop.size == 0:
+        return None, 0.0
+    gray = cleaned_crop if cleaned_crop.ndim == 2 else cv2.cvtColor(cleaned_crop, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
+
+    # 오선 제거로 끊긴 테두리 복원 → 구멍 채우기 → 줄기/꼬리 제거
+    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (1, 3)))
+    filled = fill_holes(binary)
+    k = max(3, int(spacing * 0.6) | 1)
+    opened = cv2.morphologyEx(filled, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (k, k)))
+
+    n, _, stats, centroids = cv2.connectedComponentsWithStats(opened, connectivity=8)
+    if n <= 1:
+        return None, 0.0
+    stats, centroids = stats[1:], centroids[1:]
+    w = stats[:, cv2.CC_STAT_WIDTH].astype(np.float32)
+    h = stats[:, cv2.CC_STAT_HEIGHT].astype(np.float32)
+    area = stats[:, cv2.CC_STAT_AREA].astype(np.float32)
+
+    # 기대 head: 폭 ≈ 1.3 × 간격, 높이 ≈ 간격 인 타원
+    expected_area = np.pi / 4 * (1.3 * spacing) * spacing
+    area_ratio = area / expected_area
+    aspect = w / np.maximum(h, 1)
+    ok = (area_ratio > 0.4) & (area_ratio < 1.8) & (aspect > 0.8) & (aspect < 2.2) & (h <= 1.5 * spacing)
+
+    # 줄기가 있는 음표는 head가 crop의 위/아래 끝 쪽에 있어야 함
+    crop_h = gray.shape[0]
+    if crop_h > 2.5 * spacing:
+        rel_y = centroids[:, 1] / crop_h
+        ok &= (rel_y < 0.4) | (rel_y > 0.6)
+
+    idx = np.flatnonzero(ok)
+    if idx.size == 0:
+        return None, 0.0
+    best = idx[np.argmax(area[idx])]
+    conf = float(max(0.0, 1.0 - abs(np.log(area_ratio[best]))))
+    if idx.size > 1:
+        conf *= 0.5  # 후보가 여럿(화음, 빔 조각 등)이면 모델에 맡김
+    return int(round(centroids[best, 1])), conf
+
+def staff_spacing(staff_block):
+    return float(np.mean(np.diff(sorted(staff_block)))) if len(staff_block) > 1 else 0.0
+
+def fast_note_head(cleaned, box, spacing, min_conf=HEAD_FAST_CONF):
+    # 형태학 fast-path 만 시도 → 신뢰도가 충분하면 head y, 아니면 None (head 모델이 필요)
+    if cleaned is None:
+        return None
+    x1, y1 = max(0, box['x1']), max(0, box['y1'])
+    x2, y2 = min(cleaned.shape[1], box['x2']), min(cleaned.shape[0], box['y2'])
+    head_y, conf = find_note_head_classical(cleaned[y1:y2, x1:x2], spacing)
+    if head_y is not None and conf >= min_conf:
+        return head_y + y1
+    return None
+
+def locate_note_head(image, cleaned, box, head_model, spacing, stats=None, min_conf=HEAD_FAST_CONF,
+                     debug=False):
+    # 1) 형태학 fast-path → 2) 신뢰도가 낮으면 head 모델
+    head_y = fast_note_head(cleaned, box, spacing, min_conf)
+    if head_y is not None:
+        if stats is not None:
+            stats['fast'] += 1
+        return head_y
+
+    if stats is not None:
+        stats['model'] += 1
+    return find_note_head_within_box(image, box, head_model, debug)
+
+def report_head_stats(stats):
+    total = stats['fast'] + stats['model']
+    rate = stats['fast'] / total if total else 0.0
+    print(f"[⚡ Head fast-path] {stats['fast']}/{total} ({rate:.1%}) · head 모델 호출 {stats['model']}회")
+    if 'gate' in stats:
+        gate = stats['gate']
+        print(f"[🚦 NoteCNN gate] 유지 {gate['kept']} · 재분류 {gate['relabeled']} · 제거 {gate['dropped']}"
+              f" · head 모델 호출 생략 {gate['avoided']}회")
+
 # ------------------------
 # pitch 추정
 # ------------------------
@@ -109,33 +222,78 @@ def note_name_to_midi(note_str):
 # ------------------------
 # MIDI 변환
 # ------------------------
-def convert_boxes_to_midi_from_heads(boxes, image, output_path):
-    midi = pretty_midi.PrettyMIDI()
-    instrument = pretty_midi.Instrument(program=0)
-    image_height = image.shape[0]
-    y_positions = detect_staff_lines_from_removal(image)
-    staff_blocks = cluster_staff_lines(y_positions)
+def is_note_box(box):
+    cls_name = CLASS_NAMES[int(box['cls'])]
+    return cls_name not in REST_CLASSES and cls_name in NOTE_DURATION
+
+def count_avoided_head_calls(before, after, cleaned, staff_blocks):
+    # 게이트로 음표에서 빠진 박스(제거 또는 음표가 아닌 클래스로 재분류) 중
+    # fast-path 로 해결되지 않아 head 모델을 호출했을 박스 수 (재분류 박스는 좌표가 같은 복사본)
+    remaining = Counter((b['x1'], b['y1'], b['x2'], b['y2']) for b in after if is_note_box(b))
+    avoided = 0
+    for box in before:
+        key = (box['x1'], box['y1'], box['x2'], box['y2'])
+        if remaining[key] > 0:
+            remaining[key] -= 1
+            continue
+        spacing = 0.0
+        if staff_blocks:
+            spacing = staff_spacing(find_nearest_staff_block((box['y1'] + box['y2']) / 2, staff_blocks))
+        avoided += fast_note_head(cleaned, box, spacing) is None
+    return avoided
 
-    debug_img = image.copy()
-    for y in sum(staff_blocks, []):
-        cv2.line(debug_img, (0, y), (debug_img.shape[1], y), (200, 200, 0), 1)
+def extract_note_events(boxes, image, head_model=None, cleaned=None, fast_path=True,
+                        debug_path=None, staff_blocks=None, gate=None, gate_source=None):
+    # 박스 → (x_center, midi_pitch, duration, staff) 목록 (x 순 정렬)
+    # staff: staff_blocks(위에서부터) 안에서의 오선 번호
+    # staff_blocks 를 미리 넘기면 전체 페이지 오선 검출 생략 (windowed 처리용)
+    # gate: NoteCNN 게이트 (None → MUSESCAN_NOTE_GATE 설정 따름, False → 사용 안 함)
+    # gate_source: 게이트 crop 원본 (gate_source_page 결과, 없으면 image 로 계산 → windowed 는 memmap 으로 전달)
+    image_height = image.shape[0]
+    if staff_blocks is None:
+        y_positions = detect_staff_lines_from_removal(image)
+        staff_blocks = cluster_staff_lines(y_positions)
 
     notes = []
     pitch_names = []
     head_y_list = []
-    head_model = YOLO('best/best_head.pt')
+    note_boxes = []
+    if head_model is None:
+        head_model = get_head_model()
+    if fast_path and cleaned is None:
+        cleaned = remove_staff_lines(image)
+    if not fast_path:
+        cleaned = None
+    head_stats = {'fast': 0, 'model': 0}
+
+    if gate is None:
+        gate = get_note_gate()
+    if gate:
+        # head 추정 전에 음표 박스를 한 번에 분류 → 오검출 제거 / 클래스 교정
+        if gate_source is None:
+            gate_source = gate_source_page(image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+        before = [box for box in boxes if is_note_box(box)]
+        gate_stats = {'kept': 0, 'relabeled': 0, 'dropped': 0}
+        boxes = gate_boxes(boxes, gate_source, gate, CLASS_NAMES, NOTE_DURATION, gate_stats)
+        gate_stats['avoided'] = count_avoided_head_calls(before, boxes, cleaned, staff_blocks)
+        head_stats['gate'] = gate_stats
 
     for box in boxes:
-        cls_idx = int(box['cls'])
-        cls_name = CLASS_NAMES[cls_idx]
-        if cls_name in REST_CLASSES or cls_name not in NOTE_DURATION:
+        if not is_note_box(box):
             continue
+        cls_name = CLASS_NAMES[int(box['cls'])]
 
-        head_y = find_note_head_within_box(image, box, head_model)
+        spacing = 0.0
+        if staff_blocks:
+            box_block = find_nearest_staff_block((box['y1'] + box['y2']) / 2, staff_blocks)
+            spacing = staff_spacing(box_block)
+        head_y = locate_note_head(image, cleaned, box, head_model, spacing, head_stats,
+                                  debug=bool(debug_path))
         if head_y is None:
             continue
 
         staff_block = find_nearest_staff_block(head_y, staff_blocks)
+        staff = staff_blocks.index(staff_block)
         clef = 'G' if is_upper_staff(staff_block, image_height) else 'F'
         pitch_name = estimate_pitch(head_y, staff_block, clef)
         midi_pitch = note_name_to_midi(pitch_name)
@@ -143,25 +301,71 @@ def convert_boxes_to_midi_from_heads(boxes, image, output_path):
 
         x1, y1, x2, y2 = box['x1'], box['y1'], box['x2'], box['y2']
         x_center = int((x1 + x2) / 2)
-        notes.append((x_center, midi_pitch, duration))
+        notes.append((x_center, midi_pitch, duration, staff))
         pitch_names.append(f"{pitch_name}({clef})")
         head_y_list.append(head_y)
+        note_boxes.append(box)
 
-    for box, pitch, head_y in zip(boxes, pitch_names, head_y_list):
-        x1, y1, x2, y2 = box['x1'], box['y1'], box['x2'], box['y2']
-        x_center = int((x1 + x2) / 2)
-        cv2.rectangle(debug_img, (x1, y1), (x2, y2), (0, 255, 0), 1)
-        cv2.circle(debug_img, (x_center, head_y), 3, (0, 0, 255), -1)
-        cv2.putText(debug_img, pitch, (x1, y1 - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
-
-    cv2.imwrite("debug_pitch_overlay.png", debug_img)
+    if debug_path:
+        debug_img = image.copy() if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        for y in sum(staff_blocks, []):
+            cv2.line(debug_img, (0, y), (debug_img.shape[1], y), (200, 200, 0), 1)
+        for box, pitch, head_y in zip(note_boxes, pitch_names, head_y_list):
+            x1, y1, x2, y2 = box['x1'], box['y1'], box['x2'], box['y2']
+            x_center = int((x1 + x2) / 2)
+            cv2.rectangle(debug_img, (x1, y1), (x2, y2), (0, 255, 0), 1)
+            cv2.circle(debug_img, (x_center, head_y), 3, (0, 0, 255), -1)
+            cv2.putText(debug_img, pitch, (x1, y1 - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+        cv2.imwrite(debug_path, debug_img)
 
+    report_head_stats(head_stats)
     notes.sort(key=lambda x: x[0])
+    return notes, head_stats
+
+def write_midi(pages, output_path, tempo=DEFAULT_TEMPO, program=DEFAULT_PROGRAM, velocity=DEFAULT_VELOCITY):
+    # pages: 페이지별 note 목록 → 하나의 트랙에 이어 붙임 (다음 페이지는 이전 페이지 끝에서 시작)
+    # tempo: BPM, 음길이는 DEFAULT_TEMPO 기준이므로 비율로 늘이거나 줄임
+    scale = DEFAULT_TEMPO / tempo
+    midi = pretty_midi.PrettyMIDI(initial_tempo=tempo)
+    instrument = pretty_midi.Instrument(program=program)
     time = 0.0
-    for _, pitch, dur in notes:
-        instrument.notes.append(pretty_midi.Note(velocity=100, pitch=pitch, start=time, end=time + dur))
-        time += dur
+    for notes in pages:
+        for _, pitch, dur, *_ in notes:
+            dur *= scale
+            instrument.notes.append(pretty_midi.Note(velocity=velocity, pitch=pitch, start=time, end=time + dur))
+            time += dur
 
     midi.instruments.append(instrument)
     midi.write(output_path)
     print(f"[🎵 MIDI 저장 완료] → {output_path}")
+    return time
+
+# ------------------------
+# note 이벤트 저장 / 불러오기 (검출 없이 MIDI·오디오 재생성용)
+# ------------------------
+# {"version": 1, "tempo": 기준 BPM, "pages": [[[x, pitch, duration, staff], ...], ...]}
+EVENTS_VERSION = 1
+
+def write_events(pages, output_path):
+    data = {"version": EVENTS_VERSION, "tempo": DEFAULT_TEMPO,
+            "pages": [[[int(x), int(pitch), float(dur), int(staff)] for x, pitch, dur, staff in notes]
+                      for notes in pages]}
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    return output_path
+
+def read_events(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != EVENTS_VERSION:
+        raise ValueError(f"Unsupported note event version: {data.get('version')}")
+    return [[tuple(note) for note in notes] for notes in data["pages"]]
+
+def convert_boxes_to_midi_from_heads(boxes, image, output_path, head_model=None,
+                                     cleaned=None, fast_path=True,
+                                     debug_path="debug_pitch_overlay.png", gate=None,
+                                     tempo=DEFAULT_TEMPO, program=DEFAULT_PROGRAM, velocity=DEFAULT_VELOCITY):
+    notes, head_stats = extract_note_events(boxes, image, head_model, cleaned, fast_path, debug_path,
+                                            gate=gate)
+    write_midi([notes], output_path, tempo, program, velocity)
+    return head_stats
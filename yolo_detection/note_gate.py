@@ -0,0 +1,145 @@
+import os
+import json
+import argparse
+import cv2
+import numpy as np
+import torch
+
+# ------------------------
+# NoteCNN 게이트: head 위치 추정 전에 음표 박스를 64x64 분류기로 재확인
+# ------------------------
+# YOLO 음표 박스 crop 들을 한 번의 배치로 NoteCNN 에 통과시켜
+#   - YOLO 클래스와 일치 (해당 클래스 확률 >= GATE_AGREE_CONF)  → 그대로 유지
+#   - 다른 클래스로 확신 (top 확률 >= GATE_RELABEL_CONF)        → 클래스 교체 (쉼표로 바뀌면 head 추정 생략)
+#   - 그 외 일치도가 GATE_DROP_CONF 미만                         → 오검출로 보고 제거
+# 모델 파일: TorchScript + 클래스 목록(_extra_files 의 classes.json), 아래 export 명령으로 생성
+# MUSESCAN_NOTE_GATE 가 비어 있거나 파일이 없으면 게이트 비활성
+NOTE_GATE_PATH = os.environ.get("MUSESCAN_NOTE_GATE", "")
+GATE_IMG_SIZE = 64
+GATE_AGREE_CONF = 0.5
+GATE_RELABEL_CONF = 0.8
+GATE_DROP_CONF = 0.1
+GATE_BATCH = 256
+
+
+class NoteGate:
+    def __init__(self, path):
+        extra = {"classes.json": ""}
+        self.module = torch.jit.load(path, map_location="cpu", _extra_files=extra)
+        self.module.eval()
+        self.classes = json.loads(extra["classes.json"])
+        self.path = path
+
+    def predict(self, crops):
+        # crops: uint8 (B, 64, 64) → 확률 (B, num_classes)
+        probs = []
+        with torch.inference_mode():
+            for i in range(0, len(crops), GATE_BATCH):
+                batch = torch.from_numpy(crops[i:i + GATE_BATCH])
+                x = (batch.float().unsqueeze(1) / 255.0 - 0.5) / 0.5  # feature_extractor.normalize_batch
+                probs.append(torch.softmax(self.module(x), dim=1).numpy())
+        return np.concatenate(probs) if probs else np.zeros((0, len(self.classes)), np.float32)
+
+
+_note_gate = None
+
+def get_note_gate(path=None):
+    # 게이트 모델은 프로세스당 한 번만 로드, 비활성이면 None
+    global _note_gate
+    path = path or NOTE_GATE_PATH
+    if not path or not os.path.exists(path):
+        return None
+    if _note_gate is None or _note_gate.path != path:
+        _note_gate = NoteGate(path)
+    return _note_gate
+
+def gate_source_page(gray, out=None, strip_rows=1024, margin=8):
+    # 학습 crop 의 원본과 같은 이미지: extract_candidates.remove_staff_lines (적응형 이진화 + 오선 제거)
+    # 행 band 단위로 계산하고 위아래 margin 행을 더 읽음 → 적응형 임계값(15x15)과 오선 판정(높이 < 4)이
+    # 전체 페이지에서 계산한 결과와 같음. out: 대형 페이지용 memmap (없으면 새 배열)
+    from symbol_substract.extract_candidates import remove_staff_lines
+
+    h = gray.shape[0]
+    out = np.empty(gray.shape[:2], np.uint8) if out is None else out
+    for y0 in range(0, h, strip_rows):
+        y1 = min(h, y0 + strip_rows)
+        a, b = max(0, y0 - margin), min(h, y1 + margin)
+        out[y0:y1] = remove_staff_lines(np.ascontiguousarray(gray[a:b]))[y0 - a:y1 - a]
+    return out
+
+def gate_crop(source, box, img_size=GATE_IMG_SIZE):
+    # 학습 데이터(extract_candidates.to_crop)와 같은 전처리: 흰 배경 정사각 padding → 64x64 (기본 보간 INTER_LINEAR)
+    # source: gate_source_page 결과
+    x1, y1 = max(0, box['x1']), max(0, box['y1'])
+    x2, y2 = min(source.shape[1], box['x2']), min(source.shape[0], box['y2'])
+    crop = np.asarray(source[y1:y2, x1:x2])
+    if crop.size == 0:
+        return np.full((img_size, img_size), 255, np.uint8)
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    side = max(crop.shape)
+    padded = np.full((side, side), 255, dtype=np.uint8)
+    y_off, x_off = (side - crop.shape[0]) // 2, (side - crop.shape[1]) // 2
+    padded[y_off:y_off + crop.shape[0], x_off:x_off + crop.shape[1]] = crop
+    return cv2.resize(padded, (img_size, img_size))
+
+def gate_boxes(boxes, source, gate, class_names, note_classes, stats=None):
+    # 반환: 게이트를 통과한 박스 목록 (relabel 된 박스는 복사본), stats 에 kept/relabeled/dropped 누적
+    boxes = list(boxes)
+    gate_index = {name: i for i, name in enumerate(gate.classes)}
+    # 게이트가 학습하지 않은 클래스는 판단할 수 없으므로 검사 없이 그대로 통과
+    targets = [i for i, box in enumerate(boxes)
+               if class_names[int(box['cls'])] in note_classes and class_names[int(box['cls'])] in gate_index]
+    if not targets:
+        return boxes
+
+    crops = np.stack([gate_crop(source, boxes[i]) for i in targets])
+    probs = gate.predict(crops)
+    top = probs.argmax(axis=1)
+
+    decisions = {}
+    for row, i in enumerate(targets):
+        yolo_name = class_names[int(boxes[i]['cls'])]
+        agree = probs[row, gate_index[yolo_name]]
+        top_name, top_conf = gate.classes[top[row]], probs[row, top[row]]
+        if agree >= GATE_AGREE_CONF:
+            decisions[i] = 'kept'
+        elif top_conf >= GATE_RELABEL_CONF and top_name in class_names:
+            decisions[i] = 'relabeled'
+            boxes[i] = dict(boxes[i], cls=class_names.index(top_name), gate_conf=float(top_conf))
+        elif agree < GATE_DROP_CONF:
+            decisions[i] = 'dropped'
+        else:
+            decisions[i] = 'kept'
+
+    if stats is not None:
+        for decision in decisions.values():
+            stats[decision] += 1
+    return [box for i, box in enumerate(boxes) if decisions.get(i) != 'dropped']
+
+# ------------------------
+# 학습된 NoteCNN → TorchScript 게이트 모델
+# ------------------------
+def export_gate(weights, classes, output_path, img_size=GATE_IMG_SIZE):
+    from symbol_substract.feature_extractor import NoteCNN
+
+    model = NoteCNN(num_classes=len(classes))
+    model.load_state_dict(torch.load(weights, map_location="cpu"))
+    model.eval()
+    traced = torch.jit.trace(model, torch.zeros(1, 1, img_size, img_size))
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    torch.jit.save(traced, output_path, _extra_files={"classes.json": json.dumps(classes)})
+    print(f"[✅] NoteCNN gate exported → {output_path} ({len(classes)} classes)")
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NoteCNN 게이트 모델 내보내기")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--weights", default="note_classifier_best.pth")
+    parser.add_argument("--cache", default="note_dataset_cache/", help="classes.json 이 있는 학습 캐시 폴더")
+    parser.add_argument("-o", "--output", default="best/note_gate.pt")
+    args = parser.parse_args()
+
+    with open(os.path.join(args.cache, "classes.json")) as f:
+        export_gate(args.weights, json.load(f)["classes"], args.output)
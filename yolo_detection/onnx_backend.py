@@ -0,0 +1,284 @@
+import os
+import glob
+import time
+import argparse
+import cv2
+import numpy as np
+from ultralytics import YOLO
+from yolo_detection.data_preprocess import (
+    remove_staff_lines,
+    split_image_with_offsets,
+    run_yolo_on_patches,
+    restore_to_original_coords,
+    iou
+)
+
+# ------------------------
+# 모델 경로 및 백엔드 설정
+# ------------------------
+NOTE_MODEL_PATH = "best/x_best.pt"
+HEAD_MODEL_PATH = "best/best_head.pt"
+
+# torch | onnx | onnx-int8 | openvino
+BACKEND = os.environ.get("MUSESCAN_BACKEND", "torch")
+BACKENDS = ("torch", "onnx", "onnx-int8", "openvino")
+
+
+def exported_path(pt_path, backend):
+    stem = os.path.splitext(pt_path)[0]
+    if backend == "onnx":
+        return f"{stem}.onnx"
+    if backend == "onnx-int8":
+        return f"{stem}_int8.onnx"
+    if backend == "openvino":
+        return f"{stem}_openvino_model"
+    return pt_path
+
+# ------------------------
+# 1. ONNX / OpenVINO 변환
+# ------------------------
+def export_onnx(pt_path, opset=None):
+    # imgsz는 학습 당시 값(체크포인트 args)을 그대로 사용 → PyTorch 추론과 입력 크기 일치
+    model = YOLO(pt_path)
+    kwargs = {"format": "onnx", "simplify": True, "dynamic": False}
+    if opset is not None:
+        kwargs["opset"] = opset
+    path = model.export(**kwargs)
+    print(f"[📦 ONNX 변환 완료] {pt_path} → {path}")
+    return path
+
+def export_openvino(pt_path, int8=False, data=None):
+    model = YOLO(pt_path)
+    kwargs = {"format": "openvino", "dynamic": False}
+    if int8:
+        if data is None:
+            raise ValueError("OpenVINO INT8 export needs a dataset yaml for calibration (data=...)")
+        kwargs.update(int8=True, data=data)
+    path = model.export(**kwargs)
+    print(f"[📦 OpenVINO 변환 완료] {pt_path} → {path}")
+    return path
+
+# ------------------------
+# 2. INT8 정적 양자화 (악보 타일로 보정)
+# ------------------------
+def letterbox(image, imgsz, color=(114, 114, 114)):
+    h, w = image.shape[:2]
+    r = min(imgsz / h, imgsz / w)
+    nh, nw = int(round(h * r)), int(round(w * r))
+    if (nh, nw) != (h, w):
+        image = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    top = (imgsz - nh) // 2
+    left = (imgsz - nw) // 2
+    return cv2.copyMakeBorder(image, top, imgsz - nh - top, left, imgsz - nw - left,
+                              cv2.BORDER_CONSTANT, value=color)
+
+def to_input_tensor(image, imgsz):
+    # ultralytics 전처리와 동일: letterbox → BGR→RGB → [0,1] → NCHW float32
+    img = letterbox(image, imgsz)
+    img = img[:, :, ::-1].transpose(2, 0, 1)
+    img = np.ascontiguousarray(img, dtype=np.float32) / 255.0
+    return img[None]
+
+def collect_score_tiles(image_dir, patch_size=(640, 640), stride=(480, 480), limit=256):
+    # 실제 추론 입력과 같은 분포: 오선 제거된 페이지에서 자른 타일
+    tiles = []
+    for path in sorted(glob.glob(os.path.join(image_dir, "*"))):
+        if not path.lower().endswith((".png", ".jpg", ".jpeg")):
+            continue
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        patches, _ = split_image_with_offsets(remove_staff_lines(image), patch_size, stride)
+        tiles.extend(patches)
+        if len(tiles) >= limit:
+            break
+    return tiles[:limit]
+
+def collect_crops(crop_dir, limit=256):
+    # head 모델 보정용: 음표 박스 crop (draw_final_boxes가 저장하는 cropped_notes/ 등)
+    crops = []
+    for path in sorted(glob.glob(os.path.join(crop_dir, "*.png")))[:limit]:
+        crop = cv2.imread(path)
+        if crop is not None:
+            crops.append(crop)
+    return crops
+
+def quantize_onnx_int8(onnx_path, calib_images, out_path=None, per_channel=True):
+    from onnxruntime import InferenceSession
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        CalibrationMethod,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    if not calib_images:
+        raise ValueError("No calibration images given for INT8 quantization")
+
+    session = InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    model_input = session.get_inputs()[0]
+    input_name = model_input.name
+    imgsz = int(model_input.shape[2])
+    del session
+
+    class TileReader(CalibrationDataReader):
+        def __init__(self, images):
+            self._iter = iter(images)
+
+        def get_next(self):
+            image = next(self._iter, None)
+            if image is None:
+                return None
+            return {input_name: to_input_tensor(image, imgsz)}
+
+    out_path = out_path or onnx_path.replace(".onnx", "_int8.onnx")
+    prep_path = onnx_path.replace(".onnx", "_prep.onnx")
+    quant_pre_process(onnx_path, prep_path)
+    quantize_static(
+        prep_path,
+        out_path,
+        TileReader(calib_images),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=per_channel,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    os.remove(prep_path)
+    print(f"[📦 INT8 양자화 완료] {len(calib_images)}개 보정 샘플 → {out_path}")
+    return out_path
+
+# ------------------------
+# 3. 백엔드 선택 로더
+# ------------------------
+def load_detector(pt_path, backend=None):
+    # 모든 백엔드가 ultralytics YOLO 객체로 반환되므로
+    # run_yolo_on_patches / find_note_head_within_box 는 그대로 사용 가능
+    backend = backend or BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend} (choose from {', '.join(BACKENDS)})")
+    if backend == "torch":
+        return YOLO(pt_path)
+
+    path = exported_path(pt_path, backend)
+    if not os.path.exists(path):
+        if backend == "onnx":
+            path = export_onnx(pt_path)
+        elif backend == "openvino":
+            path = export_openvino(pt_path)
+        else:
+            raise FileNotFoundError(
+                f"INT8 model not found: {path} "
+                f"(run `python -m yolo_detection.onnx_backend quantize` first)")
+    return YOLO(path, task="detect")
+
+# ------------------------
+# 4. PyTorch 대비 정합성 검사
+# ------------------------
+def _to_boxes(results):
+    # offset (0, 0) → 좌표 이동 없이 박스 dict 로만 변환 (patch_size 는 unpack 용, 좌표 계산에 쓰이지 않음)
+    return restore_to_original_coords(results, [(0, 0)] * len(results), (0, 0))
+
+def check_parity(ref_model, alt_model, images, conf=0.25, iou_thresh=0.9):
+    ref_results = run_yolo_on_patches(ref_model, images, conf=conf)
+    alt_results = run_yolo_on_patches(alt_model, images, conf=conf)
+
+    matched, ref_total, alt_total = 0, 0, 0
+    max_shift = 0
+    for ref, alt in zip(ref_results, alt_results):
+        ref_boxes = _to_boxes([ref])
+        alt_boxes = _to_boxes([alt])
+        ref_total += len(ref_boxes)
+        alt_total += len(alt_boxes)
+        unused = list(alt_boxes)
+        for rb in ref_boxes:
+            candidates = [ab for ab in unused if ab['cls'] == rb['cls']]
+            if not candidates:
+                continue
+            best = max(candidates, key=lambda ab: iou(rb, ab))
+            if iou(rb, best) >= iou_thresh:
+                matched += 1
+                unused.remove(best)
+                shift = max(abs(rb[k] - best[k]) for k in ('x1', 'y1', 'x2', 'y2'))
+                max_shift = max(max_shift, shift)
+
+    recall = matched / ref_total if ref_total else 1.0
+    precision = matched / alt_total if alt_total else 1.0
+    report = {
+        "images": len(images),
+        "ref_boxes": ref_total,
+        "alt_boxes": alt_total,
+        "matched": matched,
+        "recall": recall,
+        "precision": precision,
+        "max_shift_px": max_shift,
+    }
+    print(f"[🔍 Parity] ref={ref_total} alt={alt_total} matched={matched} "
+          f"recall={recall:.3f} precision={precision:.3f} max_shift={max_shift}px")
+    return report
+
+# ------------------------
+# 5. 벤치마크
+# ------------------------
+def benchmark(models, images, conf=0.25, warmup=3):
+    # models: {이름: YOLO}
+    report = {}
+    for name, model in models.items():
+        run_yolo_on_patches(model, images[:warmup], conf=conf)
+        start = time.perf_counter()
+        run_yolo_on_patches(model, images, conf=conf)
+        elapsed = time.perf_counter() - start
+        per_image = elapsed / max(len(images), 1)
+        report[name] = {"total_s": elapsed, "ms_per_image": per_image * 1000}
+        print(f"[⏱️ {name:>10}] {per_image * 1000:8.1f} ms/image  ({len(images)} images, {elapsed:.2f}s)")
+
+    base = report.get("torch")
+    if base:
+        for name, r in report.items():
+            if name != "torch":
+                print(f"    ➤ {name} speedup vs torch: {base['total_s'] / r['total_s']:.2f}x")
+    return report
+
+
+def _calibration_set(kind, args):
+    if kind == "head":
+        return collect_crops(args.crops, limit=args.limit)
+    return collect_score_tiles(args.images, limit=args.limit)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ONNX Runtime / OpenVINO CPU 추론 백엔드")
+    parser.add_argument("command", choices=["export", "quantize", "parity", "bench"])
+    parser.add_argument("--model", choices=["note", "head", "all"], default="all")
+    parser.add_argument("--backend", choices=BACKENDS[1:], default="onnx")
+    parser.add_argument("--images", default="images", help="보정/검증용 악보 페이지 폴더")
+    parser.add_argument("--crops", default="cropped_notes", help="head 모델 보정/검증용 음표 crop 폴더")
+    parser.add_argument("--limit", type=int, default=128)
+    args = parser.parse_args()
+
+    targets = {"note": NOTE_MODEL_PATH, "head": HEAD_MODEL_PATH}
+    kinds = ["note", "head"] if args.model == "all" else [args.model]
+
+    for kind in kinds:
+        pt_path = targets[kind]
+        print(f"\n[INFO] {kind} model: {pt_path}")
+        if args.command == "export":
+            if args.backend == "openvino":
+                export_openvino(pt_path)
+            else:
+                export_onnx(pt_path)
+        elif args.command == "quantize":
+            onnx_path = exported_path(pt_path, "onnx")
+            if not os.path.exists(onnx_path):
+                onnx_path = export_onnx(pt_path)
+            quantize_onnx_int8(onnx_path, _calibration_set(kind, args))
+        else:
+            images = _calibration_set(kind, args)
+            conf = 0.01 if kind == "head" else 0.25
+            ref = YOLO(pt_path)
+            alt = load_detector(pt_path, args.backend)
+            if args.command == "parity":
+                check_parity(ref, alt, images, conf=conf)
+            else:
+                benchmark({"torch": ref, args.backend: alt}, images, conf=conf)
@@ -0,0 +1,186 @@
+import os
+import time
+import subprocess
+from tempfile import NamedTemporaryFile
+import cv2
+import numpy as np
+from pydub import AudioSegment
+from yolo_detection.data_preprocess import (
+    remove_staff_lines,
+    split_image_with_offsets,
+    run_yolo_on_patches,
+    restore_to_original_coords,
+    apply_nms,
+    draw_final_boxes
+)
+from yolo_detection.midi_extract import (
+    extract_note_events, write_midi, get_head_model, write_events, read_events,
+    DEFAULT_TEMPO, DEFAULT_PROGRAM, DEFAULT_VELOCITY
+)
+from yolo_detection.document import iter_pages, page_count, PDF_DPI
+from yolo_detection.onnx_backend import load_detector, NOTE_MODEL_PATH
+from yolo_detection.note_gate import get_note_gate
+
+# ------------------------
+# 공통 설정
+# ------------------------
+SOUNDFONT_PATH = "FluidR3_GM.sf2"
+PATCH_SIZE = (640, 640)
+STRIDE = (480, 480)
+
+# ------------------------
+# MIDI → MP3 변환
+# ------------------------
+def midi_to_mp3(midi_path, mp3_path, soundfont_path=SOUNDFONT_PATH):
+    if not os.path.exists(soundfont_path):
+        raise FileNotFoundError(f"SoundFont not found: {soundfont_path}")
+    if not os.path.exists(midi_path):
+        raise FileNotFoundError(f"MIDI file not found: {midi_path}")
+
+    # 동시에 여러 페이지를 렌더링해도 충돌하지 않도록 호출마다 임시 WAV 사용
+    with NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
+        tmp_wav = tmp_file.name
+
+    cmd = [
+        "fluidsynth",
+        "-ni",
+        "-F", tmp_wav,
+        "-r", "44100",
+        soundfont_path,
+        midi_path
+    ]
+    try:
+        subprocess.run(cmd, check=True)
+        if not os.path.exists(tmp_wav) or os.path.getsize(tmp_wav) == 0:
+            raise RuntimeError("WAV file not created. fluidsynth failed silently.")
+
+        # pydub로 mp3 인코딩
+        audio = AudioSegment.from_wav(tmp_wav)
+        audio.export(mp3_path, format="mp3")
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"fluidsynth execution failed: {e}")
+    finally:
+        if os.path.exists(tmp_wav):
+            os.remove(tmp_wav)
+
+# ------------------------
+# 모델 로드
+# ------------------------
+def load_models(backend=None, prepare=True):
+    model = load_detector(NOTE_MODEL_PATH, backend)
+    head_model = get_head_model(backend)
+    get_note_gate()  # MUSESCAN_NOTE_GATE 설정 시 미리 로드
+    if prepare:
+        prepare_predictors(model, head_model)
+    return model, head_model
+
+def prepare_predictors(model, head_model):
+    # ultralytics 는 첫 predict 때 predictor 생성 + AutoBackend(fuse=True) 로 Conv/BN 을 합친 새 가중치를 만듦
+    # → 워커에서 처음 만들면 워커마다 사본이 생기므로, preload 부모에서 미리 만들어 fork 후 copy-on-write 로 공유
+    # 부모에서는 1 스레드로 실행해 fork 전에 torch/OpenMP 스레드 풀이 뜨지 않도록 함
+    import torch
+    threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        warm_up(model, head_model)
+    finally:
+        torch.set_num_threads(threads)
+
+def warm_up(model, head_model, patch_size=PATCH_SIZE):
+    # 빈 타일/crop으로 한 번씩 추론 → 첫 요청에서 생기는 지연(커널 선택, 메모리 할당)을 미리 소모
+    blank = np.full((patch_size[1], patch_size[0], 3), 255, np.uint8)
+    model.predict(source=blank, verbose=False)
+    head_model.predict(source=blank[:64, :64], conf=0.01, verbose=False)
+    gate = get_note_gate()
+    if gate:
+        gate.predict(np.full((1, 64, 64), 255, np.uint8))
+
+# ------------------------
+# 페이지 단위 처리
+# ------------------------
+def detect_page(image, model, conf=0.25, patch_size=PATCH_SIZE, stride=STRIDE):
+    cleaned = remove_staff_lines(image)
+    patches, positions = split_image_with_offsets(cleaned, patch_size, stride)
+    results = run_yolo_on_patches(model, patches, conf=conf)
+    restored = restore_to_original_coords(results, positions, patch_size)
+    merged_boxes = apply_nms(restored, iou_thresh=0.5)
+    return cleaned, merged_boxes
+
+def process_page(image, name, output_dir, model, head_model=None, audio=True,
+                 crop_dir=None, debug_path=None):
+    # 이미지 한 장 → 미리보기 PNG, MIDI, (선택) MP3
+    # image: BGR 또는 1채널(이진화된 업로드, decode_image(..., grayscale=True))
+    timings = {}
+    os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    cleaned, merged_boxes = detect_page(image, model)
+    timings['detect'] = time.perf_counter() - start
+
+    result_img_path = os.path.join(output_dir, f"{name}_detected.png")
+    preview = image.copy() if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    cv2.imwrite(result_img_path, draw_final_boxes(preview, merged_boxes, model.names, crop_dir))
+
+    start = time.perf_counter()
+    output_midi = os.path.join(output_dir, f"{name}.mid")
+    notes, head_stats = extract_note_events(merged_boxes, image, head_model,
+                                            cleaned=cleaned, debug_path=debug_path)
+    write_midi([notes], output_midi)
+    output_events = write_events([notes], os.path.join(output_dir, f"{name}.events.json"))
+    timings['midi'] = time.perf_counter() - start
+
+    output_mp3 = None
+    if audio:
+        start = time.perf_counter()
+        output_mp3 = os.path.join(output_dir, f"{name}.mp3")
+        midi_to_mp3(output_midi, output_mp3)
+        timings['audio'] = time.perf_counter() - start
+
+    return {
+        "preview_image": result_img_path,
+        "midi_file": output_midi,
+        "mp3_file": output_mp3,
+        "events_file": output_events,
+        "boxes": len(merged_boxes),
+        "notes": notes,
+        "head_stats": head_stats,
+        "timings": timings,
+    }
+
+def process_document(data, name, output_dir, model, head_model=None, audio=True,
+                     dpi=PDF_DPI, crop_dir=None, debug_path=None):
+    # 다중 페이지 PDF/TIFF를 한 페이지씩 처리하며 결과를 바로 내보내는 generator
+    # ➤ {"type": "page", ...} 를 페이지마다, 마지막에 합쳐진 MIDI/MP3로 {"type": "done", ...}
+    pages = page_count(data)
+    all_notes = []
+    for index, image in iter_pages(data, dpi):
+        page_name = f"{name}_p{index + 1:03}"
+        result = process_page(image, page_name, output_dir, model, head_model, audio=False,
+                              crop_dir=crop_dir, debug_path=debug_path)
+        del image
+        all_notes.append(result.pop("notes"))
+        yield {"type": "page", "page": index + 1, "pages": pages, **result}
+
+    output_midi = os.path.join(output_dir, f"{name}.mid")
+    duration = write_midi(all_notes, output_midi)
+    output_events = write_events(all_notes, os.path.join(output_dir, f"{name}.events.json"))
+    output_mp3 = None
+    if audio:
+        output_mp3 = os.path.join(output_dir, f"{name}.mp3")
+        midi_to_mp3(output_midi, output_mp3)
+    yield {"type": "done", "pages": pages, "midi_file": output_midi, "mp3_file": output_mp3,
+           "events_file": output_events, "duration": duration}
+
+# ------------------------
+# 저장된 note 이벤트 → MIDI/MP3 재생성 (이미지 처리·추론 없음)
+# ------------------------
+def render_events(events_path, name, output_dir, tempo=DEFAULT_TEMPO, program=DEFAULT_PROGRAM,
+                  velocity=DEFAULT_VELOCITY, audio=True):
+    os.makedirs(output_dir, exist_ok=True)
+    output_midi = os.path.join(output_dir, f"{name}.mid")
+    duration = write_midi(read_events(events_path), output_midi, tempo, program, velocity)
+    output_mp3 = None
+    if audio:
+        output_mp3 = os.path.join(output_dir, f"{name}.mp3")
+        midi_to_mp3(output_midi, output_mp3)
+    return {"midi_file": output_midi, "mp3_file": output_mp3, "duration": duration}
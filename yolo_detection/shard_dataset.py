@@ -0,0 +1,225 @@
+# 분할 데이터셋을 소수의 대용량 shard 파일로 묶기 / 읽기 / 폴더 구조로 되돌리기
+
+import os
+import json
+import shutil
+import argparse
+import cv2
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from yolo_detection.split_dataset import read_yolo_labels, iter_patches, format_yolo_labels
+
+# ------------------------
+# shard 형식
+# ------------------------
+# <out>/<split>-00000.bin ...  : 타일 바이트를 이어 붙인 파일
+#   codec=raw → HxWx3 uint8 그대로 (memmap 후 복사 없이 view)
+#   codec=png → 무손실 PNG 바이트 (디스크 절약, 읽을 때 디코딩)
+# <out>/<split>.index.npz       : 타일별 shard 번호/offset/길이/shape, 라벨 시작 위치/개수
+#                                 labels (M, 5) float64 [cls, x_c, y_c, w, h]
+# <out>/<split>.names.json      : 타일 이름 (폴더로 내보낼 때 파일명)
+SHARD_BYTES = 1 << 30  # shard 하나당 최대 1GB
+CODECS = ('raw', 'png')
+
+
+def encode_tile(tile, codec):
+    if codec == 'png':
+        ok, buf = cv2.imencode('.png', tile)
+        if not ok:
+            raise RuntimeError("PNG encoding failed")
+        return buf.tobytes()
+    return np.ascontiguousarray(tile).tobytes()
+
+
+class ShardWriter:
+    def __init__(self, out_dir, split, codec='raw', shard_bytes=SHARD_BYTES):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec: {codec} (choose from {', '.join(CODECS)})")
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir, self.split, self.codec, self.shard_bytes = out_dir, split, codec, shard_bytes
+        self.names, self.shard_ids, self.offsets, self.lengths, self.shapes = [], [], [], [], []
+        self.label_starts, self.label_counts, self.labels = [], [], []
+        self._shard_id = -1
+        self._file = None
+        self._written = 0
+        self._n_labels = 0
+
+    def _shard_path(self, shard_id):
+        return os.path.join(self.out_dir, f"{self.split}-{shard_id:05}.bin")
+
+    def _next_shard(self):
+        if self._file:
+            self._file.close()
+        self._shard_id += 1
+        self._file = open(self._shard_path(self._shard_id), 'wb')
+        self._written = 0
+
+    def add_tile(self, name, tile, patch_labels):
+        self.add(name, tile.shape, encode_tile(tile, self.codec), patch_labels)
+
+    def add(self, name, shape, data, patch_labels):
+        # data: encode_tile 로 미리 만든 바이트 (워커 프로세스에서 encode 가능)
+        if self._file is None or (self._written and self._written + len(data) > self.shard_bytes):
+            self._next_shard()
+        self.names.append(name)
+        self.shard_ids.append(self._shard_id)
+        self.offsets.append(self._written)
+        self.lengths.append(len(data))
+        self.shapes.append(tuple(shape))
+        self._file.write(data)
+        self._written += len(data)
+
+        patch_labels = np.asarray(patch_labels, dtype=np.float64).reshape(-1, 5)
+        self.label_starts.append(self._n_labels)
+        self.label_counts.append(len(patch_labels))
+        self.labels.append(patch_labels)
+        self._n_labels += len(patch_labels)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        np.savez(
+            os.path.join(self.out_dir, f"{self.split}.index.npz"),
+            codec=np.array(self.codec),
+            shard_ids=np.asarray(self.shard_ids, dtype=np.int32),
+            offsets=np.asarray(self.offsets, dtype=np.int64),
+            lengths=np.asarray(self.lengths, dtype=np.int64),
+            shapes=np.asarray(self.shapes, dtype=np.int32).reshape(-1, 3),
+            label_starts=np.asarray(self.label_starts, dtype=np.int64),
+            label_counts=np.asarray(self.label_counts, dtype=np.int32),
+            labels=np.concatenate(self.labels) if self.labels else np.zeros((0, 5), np.float64),
+        )
+        with open(os.path.join(self.out_dir, f"{self.split}.names.json"), 'w') as f:
+            json.dump(self.names, f)
+        print(f"[📦] {self.split}: {len(self.names)} tiles, {self._n_labels} labels, "
+              f"{self._shard_id + 1} shard(s) ({self.codec})")
+
+
+class ShardDataset:
+    # shard 파일을 memmap 으로 열어 타일 단위 랜덤 접근 (open/stat 없이 offset 으로 바로 읽기)
+    def __init__(self, shard_dir, split):
+        index = np.load(os.path.join(shard_dir, f"{split}.index.npz"))
+        self.codec = str(index['codec'])
+        self.shard_ids = index['shard_ids']
+        self.offsets = index['offsets']
+        self.lengths = index['lengths']
+        self.shapes = index['shapes']
+        self.label_starts = index['label_starts']
+        self.label_counts = index['label_counts']
+        self.labels = index['labels']
+        with open(os.path.join(shard_dir, f"{split}.names.json")) as f:
+            self.names = json.load(f)
+
+        shard_count = int(self.shard_ids.max()) + 1 if len(self.shard_ids) else 0
+        self.shards = [
+            np.memmap(os.path.join(shard_dir, f"{split}-{i:05}.bin"), dtype=np.uint8, mode='r')
+            for i in range(shard_count)
+        ]
+
+    def __len__(self):
+        return len(self.names)
+
+    def image(self, i):
+        start = self.offsets[i]
+        buf = self.shards[self.shard_ids[i]][start:start + self.lengths[i]]
+        if self.codec == 'png':
+            return cv2.imdecode(np.asarray(buf), cv2.IMREAD_COLOR)
+        return buf.reshape(tuple(self.shapes[i]))
+
+    def label(self, i):
+        start = self.label_starts[i]
+        return self.labels[start:start + self.label_counts[i]]
+
+    def __getitem__(self, i):
+        return self.image(i), self.label(i)
+
+# ------------------------
+# 원본 데이터셋 → shard
+# ------------------------
+def _encode_image(img_path, lbl_path, patch_size, stride, codec):
+    # 워커: 이미지 1장 분할 + 타일 encode → 부모 프로세스가 shard에 순서대로 기록
+    if not os.path.exists(lbl_path):
+        return []
+    image = cv2.imread(img_path)
+    labels = read_yolo_labels(lbl_path)
+    return [(name, tile.shape, encode_tile(tile, codec), patch_labels)
+            for name, tile, patch_labels in iter_patches(image, labels, img_path, patch_size, stride)]
+
+def pack_split(split, dataset_dir='dataset', output_dir='dataset_shards', patch_size=(640, 640),
+               stride=(480, 480), codec='raw', workers=None, shard_bytes=SHARD_BYTES):
+    image_dir = os.path.join(dataset_dir, 'images', split)
+    label_dir = os.path.join(dataset_dir, 'labels', split)
+    tasks = []
+    for fname in sorted(os.listdir(image_dir)):
+        if not fname.endswith('.jpg') and not fname.endswith('.png'):
+            continue
+        lbl_path = os.path.join(label_dir, os.path.splitext(fname)[0] + '.txt')
+        tasks.append((os.path.join(image_dir, fname), lbl_path, patch_size, stride, codec))
+
+    writer = ShardWriter(output_dir, split, codec, shard_bytes)
+    workers = workers or os.cpu_count() or 1
+    # 동시에 제출하는 작업을 워커 수 × 2 로 제한 → 인코딩된 타일이 메모리에 쌓이지 않음
+    # 결과는 입력 순서대로 기록하므로 shard 배치가 결정적
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for task in tasks:
+            pending.append((task, pool.submit(_encode_image, *task)))
+            if len(pending) >= workers * 2:
+                write_tiles(writer, *pending.popleft())
+        while pending:
+            write_tiles(writer, *pending.popleft())
+    writer.close()
+
+def write_tiles(writer, task, future):
+    tiles = future.result()
+    for name, shape, data, patch_labels in tiles:
+        writer.add(name, shape, data, patch_labels)
+    print(f"[INFO] Packed {os.path.basename(task[0])} ({len(tiles)} patches)")
+
+def pack_dataset(dataset_dir='dataset', output_dir='dataset_shards', patch_size=(640, 640),
+                 stride=(480, 480), codec='raw', workers=None):
+    for split in ['train', 'val']:
+        print(f"\n[INFO] Packing {split} set...")
+        pack_split(split, dataset_dir, output_dir, patch_size, stride, codec, workers)
+    shutil.copy(os.path.join(dataset_dir, 'data.yaml'), os.path.join(output_dir, 'data.yaml'))
+    print("\n✅ shard 묶기 완료")
+
+# ------------------------
+# shard → YOLO 폴더 구조
+# ------------------------
+def export_to_folders(shard_dir='dataset_shards', output_dir='dataset_split'):
+    for split in ['train', 'val']:
+        if not os.path.exists(os.path.join(shard_dir, f"{split}.index.npz")):
+            continue
+        img_dir = os.path.join(output_dir, 'images', split)
+        lbl_dir = os.path.join(output_dir, 'labels', split)
+        os.makedirs(img_dir, exist_ok=True)
+        os.makedirs(lbl_dir, exist_ok=True)
+        dataset = ShardDataset(shard_dir, split)
+        for i, name in enumerate(dataset.names):
+            image, labels = dataset[i]
+            cv2.imwrite(os.path.join(img_dir, f"{name}.jpg"), image)
+            with open(os.path.join(lbl_dir, f"{name}.txt"), 'w') as f:
+                f.write(format_yolo_labels(labels))
+        print(f"[INFO] Exported {len(dataset)} {split} tiles → {img_dir}")
+    data_yaml = os.path.join(shard_dir, 'data.yaml')
+    if os.path.exists(data_yaml):
+        shutil.copy(data_yaml, os.path.join(output_dir, 'data.yaml'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="분할 데이터셋 shard 묶기 / 폴더로 내보내기")
+    parser.add_argument("command", choices=["pack", "export"])
+    parser.add_argument("--dataset", default="dataset")
+    parser.add_argument("--shards", default="dataset_shards")
+    parser.add_argument("--output", default="dataset_split")
+    parser.add_argument("--codec", choices=CODECS, default="raw")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        pack_dataset(args.dataset, args.shards, codec=args.codec, workers=args.workers)
+    else:
+        export_to_folders(args.shards, args.output)
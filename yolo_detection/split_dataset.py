@@ -2,7 +2,11 @@
 
 import os
 import cv2
+import json
 import shutil
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 def create_dirs(base_output_dir):
     for split in ['train', 'val']:
@@ -32,8 +36,31 @@ def convert_bbox_back(x1, y1, x2, y2, patch_w, patch_h):
     h = (y2 - y1) / patch_h
     return x_c, y_c, w, h
 
-def split_image_and_labels(image, labels, img_path, output_img_dir, output_lbl_dir,
-                           patch_size=(640, 640), stride=(480, 480)):
+def assign_labels_to_patches(labels, img_w, img_h, xs, ys, patch_size=(640, 640), min_size=5):
+    # 모든 라벨 × 모든 패치를 NumPy broadcasting 으로 한 번에 계산
+    # labels: (N, 5) [cls, x_c, y_c, w, h] (정규화 좌표)
+    # 반환: keep (ny, nx, N), 패치 좌표계 박스 x1/x2 (nx, N), y1/y2 (ny, N)
+    patch_w, patch_h = patch_size
+    labels = np.asarray(labels, dtype=np.float64).reshape(-1, 5)
+    _, x_c, y_c, bw, bh = labels.T
+    x1, y1, x2, y2 = convert_bbox(x_c, y_c, bw, bh, img_w, img_h)
+    cx, cy = x_c * img_w, y_c * img_h
+
+    px = np.asarray(xs, dtype=np.float64)[:, None]
+    py = np.asarray(ys, dtype=np.float64)[:, None]
+
+    # 중심이 패치 안에 있고, 패치 좌표계로 자른 박스가 너무 작지 않으면 포함
+    new_x1 = np.maximum(x1 - px, 0)
+    new_x2 = np.minimum(x2 - px, patch_w)
+    new_y1 = np.maximum(y1 - py, 0)
+    new_y2 = np.minimum(y2 - py, patch_h)
+    ok_x = (px <= cx) & (cx <= px + patch_w) & (new_x2 - new_x1 >= min_size)
+    ok_y = (py <= cy) & (cy <= py + patch_h) & (new_y2 - new_y1 >= min_size)
+    keep = ok_y[:, None, :] & ok_x[None, :, :]
+    return keep, (new_x1, new_x2), (new_y1, new_y2)
+
+def iter_patches(image, labels, img_path, patch_size=(640, 640), stride=(480, 480)):
+    # 라벨이 하나 이상 있는 패치만 (패치 이름, 패치 이미지, 라벨 배열 (k, 5)) 순서대로 생성
     h, w = image.shape[:2]
     patch_w, patch_h = patch_size
     stride_w, stride_h = stride
@@ -41,64 +68,165 @@ def split_image_and_labels(image, labels, img_path, output_img_dir, output_lbl_d
     patch_id = 0
     base_name = os.path.splitext(os.path.basename(img_path))[0]
 
-    for y in range(0, h - patch_h + 1, stride_h):
-        for x in range(0, w - patch_w + 1, stride_w):
-            patch_img = image[y:y+patch_h, x:x+patch_w]
-            patch_labels = []
-
-            for cls, x_c, y_c, bw, bh in labels:
-                x1, y1, x2, y2 = convert_bbox(x_c, y_c, bw, bh, w, h)
-                # 중심이 패치 안에 있으면 포함
-                if x <= x_c * w <= x + patch_w and y <= y_c * h <= y + patch_h:
-                    # 박스 좌표를 패치 좌표계로 변환
-                    new_x1 = max(x1 - x, 0)
-                    new_y1 = max(y1 - y, 0)
-                    new_x2 = min(x2 - x, patch_w)
-                    new_y2 = min(y2 - y, patch_h)
-
-                    # 너무 작으면 무시
-                    if new_x2 - new_x1 < 5 or new_y2 - new_y1 < 5:
-                        continue
-
-                    new_xc, new_yc, new_w, new_h = convert_bbox_back(new_x1, new_y1, new_x2, new_y2, patch_w, patch_h)
-                    patch_labels.append(f"{cls} {new_xc:.6f} {new_yc:.6f} {new_w:.6f} {new_h:.6f}")
-
-            if patch_labels:
-                patch_name = f"{base_name}_{patch_id:04}"
-                cv2.imwrite(os.path.join(output_img_dir, f"{patch_name}.jpg"), patch_img)
-                with open(os.path.join(output_lbl_dir, f"{patch_name}.txt"), 'w') as f:
-                    f.write('\n'.join(patch_labels))
-                patch_id += 1
+    xs = list(range(0, w - patch_w + 1, stride_w))
+    ys = list(range(0, h - patch_h + 1, stride_h))
+    if not xs or not ys or len(labels) == 0:
+        return
+    classes = np.asarray(labels, dtype=np.float64).reshape(-1, 5)[:, 0]
+    keep, (new_x1, new_x2), (new_y1, new_y2) = assign_labels_to_patches(labels, w, h, xs, ys, patch_size)
+
+    for iy, y in enumerate(ys):
+        for ix, x in enumerate(xs):
+            idx = np.flatnonzero(keep[iy, ix])
+            if idx.size == 0:
+                continue
+
+            new_xc, new_yc, new_w, new_h = convert_bbox_back(
+                new_x1[ix, idx], new_y1[iy, idx], new_x2[ix, idx], new_y2[iy, idx], patch_w, patch_h)
+            patch_labels = np.stack([classes[idx], new_xc, new_yc, new_w, new_h], axis=1)
+
+            yield f"{base_name}_{patch_id:04}", image[y:y+patch_h, x:x+patch_w], patch_labels
+            patch_id += 1
+
+def format_yolo_labels(patch_labels):
+    return '\n'.join(f"{int(cls)} {xc:.6f} {yc:.6f} {bw:.6f} {bh:.6f}"
+                     for cls, xc, yc, bw, bh in patch_labels)
+
+def split_image_and_labels(image, labels, img_path, output_img_dir, output_lbl_dir,
+                           patch_size=(640, 640), stride=(480, 480)):
+    patch_names = []
+    for patch_name, patch_img, patch_labels in iter_patches(image, labels, img_path, patch_size, stride):
+        cv2.imwrite(os.path.join(output_img_dir, f"{patch_name}.jpg"), patch_img)
+        with open(os.path.join(output_lbl_dir, f"{patch_name}.txt"), 'w') as f:
+            f.write(format_yolo_labels(patch_labels))
+        patch_names.append(patch_name)
+    return patch_names
+
+# ------------------------
+# 증분 재분할용 매니페스트
+# ------------------------
+MANIFEST_NAME = 'manifest.json'
+
+def file_hash(path):
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def remove_patches(patch_names, output_img_dir, output_lbl_dir):
+    for name in patch_names:
+        for path in (os.path.join(output_img_dir, f"{name}.jpg"), os.path.join(output_lbl_dir, f"{name}.txt")):
+            if os.path.exists(path):
+                os.remove(path)
+
+def source_entry(img_path, lbl_path, patch_size, stride):
+    return {
+        'image_hash': file_hash(img_path),
+        'label_hash': file_hash(lbl_path),
+        'patch_size': list(patch_size),
+        'stride': list(stride),
+    }
+
+def process_image(img_path, lbl_path, output_img_dir, output_lbl_dir, patch_size, stride):
+    # 워커 프로세스 단위 작업: 이미지 1장 분할
+    if not os.path.exists(lbl_path):
+        return os.path.basename(img_path), []
+    image = cv2.imread(img_path)
+    labels = read_yolo_labels(lbl_path)
+    patch_names = split_image_and_labels(image, labels, img_path, output_img_dir, output_lbl_dir,
+                                         patch_size, stride)
+    return os.path.basename(img_path), patch_names
 
 def process_dataset_split(split, dataset_dir='dataset', output_dir='dataset_split',
-                          patch_size=(640, 640), stride=(480, 480)):
+                          patch_size=(640, 640), stride=(480, 480), workers=None, manifest=None):
+    # manifest: 이 split의 {파일명: {해시, 패치 설정, 생성된 패치 목록}}
+    # 주어지면 새로 생겼거나 바뀐 원본만 다시 분할하고, 사라진 원본의 패치는 삭제
     image_dir = os.path.join(dataset_dir, 'images', split)
     label_dir = os.path.join(dataset_dir, 'labels', split)
 
     output_img_dir = os.path.join(output_dir, 'images', split)
     output_lbl_dir = os.path.join(output_dir, 'labels', split)
 
-    for fname in os.listdir(image_dir):
+    previous = manifest or {}
+    updated = {}
+    tasks = []
+    entries = {}
+    for fname in sorted(os.listdir(image_dir)):
         if not fname.endswith('.jpg') and not fname.endswith('.png'):
             continue
-
         img_path = os.path.join(image_dir, fname)
         lbl_path = os.path.join(label_dir, os.path.splitext(fname)[0] + '.txt')
-
-        image = cv2.imread(img_path)
-        if not os.path.exists(lbl_path):
+        entry = source_entry(img_path, lbl_path, patch_size, stride)
+        old = previous.get(fname)
+        if old is not None and all(old.get(k) == v for k, v in entry.items()):
+            updated[fname] = old
             continue
+        if old is not None:
+            remove_patches(old.get('patches', []), output_img_dir, output_lbl_dir)
+        entries[fname] = entry
+        tasks.append((img_path, lbl_path, output_img_dir, output_lbl_dir, patch_size, stride))
+
+    for fname in set(previous) - set(entries) - set(updated):
+        remove_patches(previous[fname].get('patches', []), output_img_dir, output_lbl_dir)
+        print(f"[INFO] Removed patches of deleted source {fname}")
+
+    if manifest is not None:
+        print(f"[INFO] {len(updated)} unchanged, {len(tasks)} to (re)build")
+
+    def record(fname, patch_names):
+        updated[fname] = dict(entries[fname], patches=patch_names)
+        print(f"[INFO] Processed {fname} ({len(patch_names)} patches)")
+
+    # 패치 이름은 원본 파일명 + 원본 내 순번이라 병렬 처리 순서와 무관하게 결정적
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            record(*process_image(*task))
+        return updated
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_image, *task) for task in tasks]
+        for future in as_completed(futures):
+            record(*future.result())
+    return updated
+
+def clear_split_outputs(output_dir):
+    # 전체 재분할: 이전 실행의 패치를 모두 지움 (매니페스트에 없는 패치 포함)
+    for split in ['train', 'val']:
+        for kind in ['images', 'labels']:
+            shutil.rmtree(os.path.join(output_dir, kind, split), ignore_errors=True)
 
-        labels = read_yolo_labels(lbl_path)
-        split_image_and_labels(image, labels, img_path, output_img_dir, output_lbl_dir,
-                               patch_size, stride)
-        print(f"[INFO] Processed {fname}")
-
-def run_all(dataset_dir='dataset', output_dir='dataset_split', patch_size=(640, 640), stride=(480, 480)):
+def run_all(dataset_dir='dataset', output_dir='dataset_split', patch_size=(640, 640), stride=(480, 480),
+            workers=None, incremental=True):
+    if not incremental:
+        clear_split_outputs(output_dir)
     create_dirs(output_dir)
+    manifest = load_manifest(output_dir) if incremental else {}
     for split in ['train', 'val']:
         print(f"\n[INFO] Processing {split} set...")
-        process_dataset_split(split, dataset_dir, output_dir, patch_size, stride)
+        split_manifest = manifest.get(split, {}) if incremental else None
+        manifest[split] = process_dataset_split(split, dataset_dir, output_dir, patch_size, stride,
+                                                workers, split_manifest)
+        save_manifest(output_dir, manifest)
         shutil.copy(os.path.join(dataset_dir, 'data.yaml'), os.path.join(output_dir, 'data.yaml'))
     print("\n✅ 모든 이미지와 라벨이 분할 완료되었습니다.")
 
@@ -0,0 +1,294 @@
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+import cv2
+from yolo_detection.data_preprocess import (
+    remove_staff_lines,
+    split_image_with_offsets,
+    run_yolo_on_patches,
+    restore_to_original_coords,
+    apply_nms,
+    draw_final_boxes
+)
+from yolo_detection.midi_extract import extract_note_events, write_midi, write_events
+from yolo_detection.document import iter_pages, page_count, decode_image, PDF_DPI
+from yolo_detection.pipeline import midi_to_mp3, PATCH_SIZE, STRIDE
+from yolo_detection.onnx_backend import BACKEND
+
+# ------------------------
+# 단계별 파이프라인 실행기
+# ------------------------
+# 페이지 처리를 단계로 나누고 단계 사이를 크기 제한 큐로 연결
+#   prepare(디코딩·오선 제거·타일 분할) → detect(YOLO) → locate(NMS·head 추정) → midi → audio(fluidsynth)
+# 단계마다 워커 스레드 수를 따로 두어, 여러 페이지/요청이 동시에 들어오면
+# OpenCV 전처리 · 모델 추론 · 오디오 합성이 서로 겹쳐서 실행됨
+# (OpenCV / torch / fluidsynth 서브프로세스 모두 GIL 밖에서 동작)
+# 큐가 가득 차면 앞 단계가 대기 → 메모리에 올라오는 페이지 수가 제한됨
+# YOLO 모델 객체는 스레드 간 공유가 안전하지 않으므로 detect / locate 는 기본 1 워커이고,
+# 모델 호출은 model_lock(note 모델) / head_lock(head 모델·게이트)으로 감쌈
+# → 워커 수를 늘리거나 파이프라인 밖(windowed 처리, warm-up)에서 같은 모델을 써도 동시에 추론하지 않음
+STAGE_WORKERS = {"prepare": 2, "detect": 1, "locate": 1, "midi": 1, "audio": 2}
+QUEUE_SIZE = int(os.environ.get("MUSESCAN_STAGE_QUEUE", 4))
+# detect 단계는 대기 중인 페이지들을 한꺼번에 가져와 타일을 모아 배치 추론 (한 번의 predict 당 최대 타일 수)
+# 변환 모델(onnx/openvino)은 batch 1 고정으로 export 되므로 기본 1
+DETECT_BATCH = int(os.environ.get("MUSESCAN_DETECT_BATCH", 32 if BACKEND == "torch" else 1))
+
+
+def parse_stage_workers(spec):
+    # "prepare=4,audio=3" → STAGE_WORKERS 덮어쓰기 (MUSESCAN_STAGE_WORKERS)
+    workers = dict(STAGE_WORKERS)
+    for item in filter(None, (spec or "").split(",")):
+        name, _, count = item.partition("=")
+        if name.strip() not in workers:
+            raise ValueError(f"Unknown stage: {name} (choose from {', '.join(workers)})")
+        workers[name.strip()] = max(1, int(count))
+    return workers
+
+
+class Stage:
+    # batch 지정 시: 큐에 이미 쌓여 있는 job 을 최대 batch 개까지 모아 fn(jobs 목록)으로 한 번에 처리
+    def __init__(self, name, fn, workers=1, queue_size=QUEUE_SIZE, batch=None):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.batch = batch
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.busy = 0
+        self.done = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+
+class StagedPipeline:
+    def __init__(self, stages, finish=None):
+        self.stages = stages
+        self.finish = finish or (lambda job: job)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._started = False
+
+    def start(self):
+        # 스레드는 fork 후 워커 프로세스에서 시작해야 하므로 생성과 분리
+        with self._lock:
+            if self._started:
+                return
+            for index, stage in enumerate(self.stages):
+                for n in range(stage.workers):
+                    thread = threading.Thread(target=self._run, args=(index,),
+                                              name=f"stage-{stage.name}-{n}", daemon=True)
+                    thread.start()
+                    self._threads.append((index, thread))
+            self._started = True
+
+    def stop(self):
+        # 앞 단계부터 차례로 종료: 단계 i 에 종료 신호를 넣고 그 워커가 모두 끝난 뒤 단계 i+1 로
+        # → 앞 단계가 남은 job 을 다음 큐에 넘기는 동안 다음 단계는 아직 실행 중이므로
+        #   next_queue.put 에서 영원히 막히지 않고, 이미 들어온 job 의 Future 도 모두 완료됨
+        with self._lock:
+            if not self._started:
+                return
+            threads, self._threads = self._threads, []
+            self._started = False
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                stage.queue.put(None)
+            for thread_index, thread in threads:
+                if thread_index == index:
+                    thread.join()
+
+    def submit(self, job):
+        # job: 단계 함수들이 채워 나가는 dict. 첫 큐가 가득 차면 자리가 날 때까지 대기
+        self.start()
+        future = Future()
+        job.setdefault("timings", {})
+        self.stages[0].queue.put((job, future))
+        return future
+
+    def _take(self, stage):
+        # 첫 job 은 대기, 나머지는 이미 큐에 있는 것만 (배치를 채우려고 기다리지 않음)
+        # 종료 신호(None)를 만나면 모은 job 까지 처리한 뒤 종료
+        item = stage.queue.get()
+        if item is None:
+            return [], True
+        items = [item]
+        while len(items) < (stage.batch or 1):
+            try:
+                item = stage.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def _run(self, index):
+        stage = self.stages[index]
+        next_queue = self.stages[index + 1].queue if index + 1 < len(self.stages) else None
+        while True:
+            items, stopping = self._take(stage)
+            if items:
+                self._process(stage, items, next_queue)
+            if stopping:
+                return
+
+    def _process(self, stage, items, next_queue):
+        # 취소된 요청(job["cancelled"] 이벤트 설정)의 job 은 실행하지 않고 Future 를 취소
+        live = []
+        for job, future in items:
+            cancelled = job.get("cancelled")
+            if cancelled is not None and cancelled.is_set():
+                future.cancel()
+            else:
+                live.append((job, future))
+        if not live:
+            return
+        items = live
+        jobs = [job for job, _ in items]
+        with self._lock:
+            stage.busy += len(items)
+        start = time.perf_counter()
+        try:
+            stage.fn(jobs) if stage.batch else stage.fn(jobs[0])
+            failed = None
+        except Exception as e:
+            failed = e
+        elapsed = time.perf_counter() - start
+        for job in jobs:
+            job["timings"][stage.name] = elapsed
+        with self._lock:
+            stage.busy -= len(items)
+            stage.done += len(items)
+            stage.seconds += elapsed * len(items)
+            stage.errors += len(items) if failed is not None else 0
+
+        for job, future in items:
+            if failed is not None:
+                future.set_exception(failed)
+            elif next_queue is not None:
+                next_queue.put((job, future))
+            else:
+                try:
+                    future.set_result(self.finish(job))
+                except Exception as e:
+                    future.set_exception(e)
+
+    def stats(self):
+        # 단계별 대기열 깊이 / 처리 중 / 누적 처리량 → 단계별 워커 수 조정 근거
+        with self._lock:
+            return {stage.name: {
+                "queued": stage.queue.qsize(),
+                "capacity": stage.queue.maxsize,
+                "workers": stage.workers,
+                "busy": stage.busy,
+                "done": stage.done,
+                "errors": stage.errors,
+                "avg_seconds": stage.seconds / stage.done if stage.done else 0.0,
+            } for stage in self.stages}
+
+# ------------------------
+# 페이지 처리 단계 (pipeline.process_page 와 같은 결과)
+# ------------------------
+def build_page_pipeline(model, head_model=None, workers=None, queue_size=QUEUE_SIZE, conf=0.25,
+                        model_lock=None, head_lock=None, detect_batch=DETECT_BATCH):
+    workers = workers or parse_stage_workers(os.environ.get("MUSESCAN_STAGE_WORKERS"))
+    model_lock = model_lock or threading.Lock()
+    head_lock = head_lock or threading.Lock()
+
+    def prepare(job):
+        if job.get("image") is None:
+            job["image"] = decode_image(job.pop("data"), grayscale=job.get("grayscale", False))
+        job["cleaned"] = remove_staff_lines(job["image"])
+        job["patches"], job["positions"] = split_image_with_offsets(job["cleaned"], PATCH_SIZE, STRIDE)
+
+    def detect(jobs):
+        # 여러 페이지의 타일을 한 목록으로 모아 배치 추론 → 페이지별로 다시 나눔
+        counts = [len(job["patches"]) for job in jobs]
+        patches = [patch for job in jobs for patch in job.pop("patches")]
+        with model_lock:
+            results = run_yolo_on_patches(model, patches, conf=conf, batch_size=detect_batch)
+        del patches
+        start = 0
+        for job, count in zip(jobs, counts):
+            job["results"] = results[start:start + count]
+            start += count
+
+    def locate(job):
+        restored = restore_to_original_coords(job.pop("results"), job.pop("positions"), PATCH_SIZE)
+        boxes = apply_nms(restored, iou_thresh=0.5)
+        image = job["image"]
+        job["boxes"] = len(boxes)
+        job["preview_image"] = os.path.join(job["output_dir"], f"{job['name']}_detected.png")
+        preview = image.copy() if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        cv2.imwrite(job["preview_image"], draw_final_boxes(preview, boxes, model.names, job.get("crop_dir")))
+        with head_lock:
+            job["notes"], job["head_stats"] = extract_note_events(boxes, image, head_model,
+                                                                  cleaned=job.pop("cleaned"),
+                                                                  debug_path=job.get("debug_path"))
+        del job["image"]
+
+    def midi(job):
+        base = os.path.join(job["output_dir"], job["name"])
+        job["midi_file"] = base + ".mid"
+        write_midi([job["notes"]], job["midi_file"])
+        job["events_file"] = write_events([job["notes"]], base + ".events.json")
+
+    def audio(job):
+        job["mp3_file"] = None
+        if job.get("audio"):
+            job["mp3_file"] = os.path.join(job["output_dir"], f"{job['name']}.mp3")
+            midi_to_mp3(job["midi_file"], job["mp3_file"])
+
+    def finish(job):
+        return {key: job[key] for key in ("preview_image", "midi_file", "mp3_file", "events_file",
+                                          "boxes", "notes", "head_stats", "timings")}
+
+    # detect 는 큐에 쌓인 페이지를 최대 queue_size 개까지 한 번에 가져옴
+    batches = {"detect": queue_size}
+    stages = [Stage(name, fn, workers[name], queue_size, batches.get(name))
+              for name, fn in (("prepare", prepare), ("detect", detect), ("locate", locate),
+                               ("midi", midi), ("audio", audio))]
+    return StagedPipeline(stages, finish)
+
+def submit_page(pipeline, name, output_dir, image=None, data=None, grayscale=False, audio=True,
+                crop_dir=None, debug_path=None, cancelled=None):
+    # image(디코딩된 배열) 또는 data(인코딩된 바이트, prepare 단계에서 디코딩) 중 하나
+    # cancelled: threading.Event → 설정되면 아직 끝나지 않은 단계를 건너뛰고 Future 취소
+    os.makedirs(output_dir, exist_ok=True)
+    return pipeline.submit({"name": name, "output_dir": output_dir, "image": image, "data": data,
+                            "grayscale": grayscale, "audio": audio, "crop_dir": crop_dir,
+                            "debug_path": debug_path, "cancelled": cancelled})
+
+def process_document_staged(data, name, output_dir, pipeline, audio=True, dpi=PDF_DPI,
+                            crop_dir=None, debug_path=None):
+    # pipeline.process_document 와 같은 이벤트를 내보내되, 페이지를 파이프라인에 연달아 넣어
+    # 앞 페이지의 추론/합성과 다음 페이지의 래스터화·전처리가 겹치도록 함 (결과는 페이지 순서대로)
+    pages = page_count(data)
+    pending = deque()
+    all_notes = []
+
+    def finished(index, future):
+        result = future.result()
+        all_notes.append(result.pop("notes"))
+        return {"type": "page", "page": index + 1, "pages": pages, **result}
+
+    for index, image in iter_pages(data, dpi):
+        pending.append((index, submit_page(pipeline, f"{name}_p{index + 1:03}", output_dir, image=image,
+                                           audio=False, crop_dir=crop_dir, debug_path=debug_path)))
+        del image
+        while pending and pending[0][1].done():
+            yield finished(*pending.popleft())
+    while pending:
+        yield finished(*pending.popleft())
+
+    output_midi = os.path.join(output_dir, f"{name}.mid")
+    duration = write_midi(all_notes, output_midi)
+    output_events = write_events(all_notes, os.path.join(output_dir, f"{name}.events.json"))
+    output_mp3 = None
+    if audio:
+        output_mp3 = os.path.join(output_dir, f"{name}.mp3")
+        midi_to_mp3(output_midi, output_mp3)
+    yield {"type": "done", "pages": pages, "midi_file": output_midi, "mp3_file": output_mp3,
+           "events_file": output_events, "duration": duration}
@@ -0,0 +1,185 @@
+import os
+import time
+from contextlib import nullcontext
+from tempfile import TemporaryDirectory
+import cv2
+import numpy as np
+from yolo_detection.data_preprocess import (
+    remove_staff_lines_gray,
+    split_image_with_offsets,
+    run_yolo_on_patches,
+    restore_to_original_coords,
+    apply_nms,
+    draw_final_boxes
+)
+from yolo_detection.midi_extract import cluster_staff_lines, extract_note_events, write_midi, write_events
+from yolo_detection.note_gate import get_note_gate, gate_source_page
+
+# ------------------------
+# 대형 스캔용 band 단위(windowed) 처리
+# ------------------------
+# 페이지 전체를 메모리에 올리지 않고 위에서 아래로 band 단위로 읽는다.
+# 원본/오선 제거 grayscale은 디스크 기반 memmap에만 쓰고,
+# 메모리에는 band 버퍼와 검출 박스 목록만 남는다.
+PATCH_SIZE = (640, 640)
+STRIDE = (480, 480)
+PREVIEW_MAX_SIDE = 2000
+
+
+class VipsPageReader:
+    # libvips sequential 디코더: 위→아래 순서로 필요한 줄만 디코딩
+    def __init__(self, path):
+        import pyvips
+        image = pyvips.Image.new_from_file(path, access="sequential")
+        if image.hasalpha():
+            image = image.flatten(background=255)
+        if image.bands > 1:
+            image = image.colourspace("b-w")[0]
+        self.image = image.cast("uchar")
+        self.width, self.height = self.image.width, self.image.height
+
+    def read_rows(self, y0, y1):
+        region = self.image.crop(0, y0, self.width, y1 - y0)
+        return np.ndarray(buffer=region.write_to_memory(), dtype=np.uint8,
+                          shape=(y1 - y0, self.width))
+
+
+class DecodedPageReader:
+    # pyvips가 없을 때: grayscale로 한 번만 디코딩 (BGR 대비 1/3, 중간 사본 없음)
+    def __init__(self, path):
+        self.gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if self.gray is None:
+            raise ValueError(f"Could not decode image: {path}")
+        self.height, self.width = self.gray.shape
+
+    def read_rows(self, y0, y1):
+        return self.gray[y0:y1]
+
+
+def open_page_reader(path):
+    try:
+        return VipsPageReader(path)
+    except (ImportError, OSError) as e:
+        # pyvips 미설치 또는 libvips 공유 라이브러리를 찾지 못함 → 전체 페이지 디코딩 (메모리 ∝ 페이지 크기)
+        print(f"[⚠️] pyvips unavailable ({e}), decoding the whole page: {path}")
+        return DecodedPageReader(path)
+
+
+class GrayPage:
+    # memmap grayscale을 BGR 이미지처럼 slicing (head crop 용)
+    def __init__(self, gray):
+        self.gray = gray
+        self.shape = gray.shape + (3,)
+
+    def __getitem__(self, index):
+        return cv2.cvtColor(np.ascontiguousarray(self.gray[index]), cv2.COLOR_GRAY2BGR)
+
+
+def prepare_page(path, work_dir, strip_rows=PATCH_SIZE[1], preview_max=PREVIEW_MAX_SIDE):
+    # pass 1: band 단위로 디코딩 → 오선 제거 + 오선 행 검출 + 미리보기 축소본 생성
+    reader = open_page_reader(path)
+    h, w = reader.height, reader.width
+    original = np.memmap(os.path.join(work_dir, "original.u8"), np.uint8, "w+", shape=(h, w))
+    cleaned = np.memmap(os.path.join(work_dir, "cleaned.u8"), np.uint8, "w+", shape=(h, w))
+
+    scale = min(1.0, preview_max / max(h, w))
+    preview = np.zeros((max(1, int(h * scale)), max(1, int(w * scale))), np.uint8)
+    staff_rows = []
+
+    for y0 in range(0, h, strip_rows):
+        y1 = min(h, y0 + strip_rows)
+        gray = reader.read_rows(y0, y1)
+        no_staff, lines = remove_staff_lines_gray(gray, page_width=w)
+        original[y0:y1] = gray
+        cleaned[y0:y1] = no_staff
+
+        counts = np.count_nonzero(lines, axis=1)
+        staff_rows.extend((y0 + np.flatnonzero(counts > 0.5 * w)).tolist())
+
+        p0, p1 = int(y0 * scale), max(int(y0 * scale) + 1, int(y1 * scale))
+        p1 = min(p1, preview.shape[0])
+        if p1 > p0:
+            preview[p0:p1] = cv2.resize(gray, (preview.shape[1], p1 - p0), interpolation=cv2.INTER_AREA)
+        del gray, no_staff, lines
+
+    original.flush()
+    cleaned.flush()
+    return original, cleaned, staff_rows, preview, scale
+
+
+def detect_windowed(cleaned, model, conf=0.25, patch_size=PATCH_SIZE, stride=STRIDE, model_lock=None):
+    # pass 2: 타일 높이만큼의 band를 stride 간격으로 겹쳐 읽으며 검출
+    # model_lock: 서버의 단계별 파이프라인과 모델을 공유할 때 band 단위로만 잡음 (다른 페이지가 사이사이 진행)
+    h = cleaned.shape[0]
+    pw, ph = patch_size
+    boxes = []
+    for y in range(0, h - ph + 1, stride[1]):
+        band = cv2.cvtColor(np.ascontiguousarray(cleaned[y:y + ph]), cv2.COLOR_GRAY2BGR)
+        patches, positions = split_image_with_offsets(band, patch_size, stride)
+        with model_lock or nullcontext():
+            results = run_yolo_on_patches(model, patches, conf=conf)
+        boxes.extend(restore_to_original_coords(results, [(x, y + py) for x, py in positions], patch_size))
+        del band, patches, results
+    return apply_nms(boxes, iou_thresh=0.5)
+
+
+def draw_preview(preview, boxes, scale, class_names):
+    scaled = [{**b, 'x1': int(b['x1'] * scale), 'y1': int(b['y1'] * scale),
+               'x2': int(b['x2'] * scale), 'y2': int(b['y2'] * scale)} for b in boxes]
+    return draw_final_boxes(cv2.cvtColor(preview, cv2.COLOR_GRAY2BGR), scaled, class_names, crop_dir=None)
+
+
+def process_page_windowed(path, name, output_dir, model, head_model=None, audio=True,
+                          model_lock=None, head_lock=None):
+    # pipeline.process_page 와 같은 결과 형식, 피크 메모리는 페이지 크기와 무관
+    # model_lock / head_lock: staged.build_page_pipeline 에 넘긴 것과 같은 잠금 (서버에서 모델 공유 시)
+    from yolo_detection.pipeline import midi_to_mp3
+
+    timings = {}
+    os.makedirs(output_dir, exist_ok=True)
+    # 페이지 전체 memmap 은 output_dir(서버에서는 작업별 staging 폴더) 아래에 생성
+    # → 기본 /tmp 가 tmpfs(RAM)인 시스템에서도 디스크에 기록
+    with TemporaryDirectory(prefix="musescan_", dir=output_dir) as work_dir:
+        start = time.perf_counter()
+        original, cleaned, staff_rows, preview, scale = prepare_page(path, work_dir)
+        merged_boxes = detect_windowed(cleaned, model, model_lock=model_lock)
+        timings['detect'] = time.perf_counter() - start
+
+        result_img_path = os.path.join(output_dir, f"{name}_detected.png")
+        cv2.imwrite(result_img_path, draw_preview(preview, merged_boxes, scale, model.names))
+        del preview
+
+        start = time.perf_counter()
+        staff_blocks = cluster_staff_lines(staff_rows) if staff_rows else []
+        gate_source = None
+        if get_note_gate():
+            # 게이트 crop 원본(학습 전처리)도 band 단위로 memmap 에 계산
+            gate_source = gate_source_page(original, out=np.memmap(os.path.join(work_dir, "gate.u8"), np.uint8,
+                                                                   "w+", shape=original.shape))
+        with head_lock or nullcontext():
+            notes, head_stats = extract_note_events(merged_boxes, GrayPage(original), head_model,
+                                                    cleaned=cleaned, staff_blocks=staff_blocks,
+                                                    gate_source=gate_source)
+        output_midi = os.path.join(output_dir, f"{name}.mid")
+        write_midi([notes], output_midi)
+        output_events = write_events([notes], os.path.join(output_dir, f"{name}.events.json"))
+        timings['midi'] = time.perf_counter() - start
+        del original, cleaned, gate_source
+
+    output_mp3 = None
+    if audio:
+        start = time.perf_counter()
+        output_mp3 = os.path.join(output_dir, f"{name}.mp3")
+        midi_to_mp3(output_midi, output_mp3)
+        timings['audio'] = time.perf_counter() - start
+
+    return {
+        "preview_image": result_img_path,
+        "midi_file": output_midi,
+        "mp3_file": output_mp3,
+        "events_file": output_events,
+        "boxes": len(merged_boxes),
+        "notes": notes,
+        "head_stats": head_stats,
+        "timings": timings,
+    }